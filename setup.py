@@ -8,11 +8,17 @@ from setuptools import setup
 with open("README.md") as f:
     description = f.read()
 
-install_requires = ["click", "pint", "aiodns", "netifaces", "beautifultable>=1"]
+install_requires = [
+    "click", "pint", "aiodns", "netifaces", "beautifultable>=1",
+    'importlib_metadata; python_version < "3.8"',
+]
 
 extras_require = {
     "basler": ["pylonctl"],
-    "eiger": ["aiohttp"]
+    "eiger": ["aiohttp"],
+    "hdf5": ["h5py"],
+    "simulator": [],
+    "yaml": ["PyYAML"],
 }
 extras_require["all"] = install_requires + list(
     set.union(*(set(i) for i in extras_require.values()))
@@ -36,10 +42,11 @@ setup(
         "limatb.cli.camera": [
             "Basler = limatb.camera.basler:basler [basler]",
             "Eiger = limatb.camera.eiger:eiger [eiger]",
+            "Simulator = limatb.camera.simulator:simulator [simulator]",
         ],
         "limatb.cli.camera.scan": [
             "Basler = limatb.camera.basler:scan [basler]",
-            "Eiger = limatb.camera.eiger:scan [eiger]",
+            "Eiger = limatb.camera.eiger:scan_stream [eiger]",
         ],
     },
     install_requires=install_requires,
@@ -1,19 +1,36 @@
 import os
-import glob
+import sys
 import time
 import signal
-import pathlib
+import threading
+import contextlib
+import collections
 
 import click
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit import print_formatted_text, HTML
+from prompt_toolkit.output import create_output
 from prompt_toolkit.shortcuts import ProgressBar
+from prompt_toolkit.application import create_app_session
 
 import Lima.Core
 from Lima.Core import AcqRunning, AcqFault, FrameDim
 
+from .storage import (
+    iter_files, only_contains, remove_files, remove_directory_in_background,
+    measure_write_speed, scratch_directory,
+)
+from . import plan
+from .timeline import TimelineRecorder, percentile
+from .soak import SoakRecorder, iterations, rss
+from .framestats import FrameStatisticsMonitor, statistics_text
+from .progress import NullProgress, JsonlProgress
+from .verify import verify
+from .processing import roi, binning, processing_stages, install
+from . import autotune
+from .cli import camera_key
 from .util import (
-    ur, ErrorMap, FileFormat, TriggerMode,
+    unit_registry, ErrorMap, AcqStatusMap, FileFormat, TriggerMode,
     SavingPolicy, SavingMode, SavingManagedMode,
 )
 
@@ -51,6 +68,7 @@ class ReportTask:
         if exc_type is None:
             msg = self.DONE
             if not self.skipped:
+                ur = unit_registry()
                 elapsed = ((self.elapsed) * ur.s).to_compact()
                 msg += ' (took {:~.4})'.format(elapsed)
         elif exc_type is KeyboardInterrupt:
@@ -61,6 +79,47 @@ class ReportTask:
         return False
 
 
+ImageCounters = collections.namedtuple(
+    "ImageCounters",
+    "LastImageAcquired LastBaseImageReady LastImageReady LastImageSaved"
+)
+
+
+def image_counters(status):
+    """Detached copy of a Lima ImageStatus (safe to keep after the callback)"""
+    return ImageCounters._make(getattr(status, name) for name in ImageCounters._fields)
+
+
+class StatusQueue:
+    """
+    Coalescing single slot queue.
+
+    Only the latest value is kept and the consumer is woken up only when
+    the value actually changes.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._pending = False
+
+    def put(self, value):
+        with self._cond:
+            if value == self._value:
+                return
+            self._value = value
+            self._pending = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Latest value or None if it didn't change within timeout"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending, timeout):
+                return None
+            self._pending = False
+            return self._value
+
+
 class AcquisitionContext(Lima.Core.CtControl.ImageStatusCallback):
 
     def __init__(self, ctrl, cb=None):
@@ -69,6 +128,8 @@ class AcquisitionContext(Lima.Core.CtControl.ImageStatusCallback):
         self.cb = cb
 
     def __enter__(self):
+        if self.cb is not None:
+            self.ctrl.registerImageStatusCallback(self)
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
@@ -76,6 +137,12 @@ class AcquisitionContext(Lima.Core.CtControl.ImageStatusCallback):
             self.stopAcq()
         elif self.status.AcquisitionStatus == AcqRunning:
             self.stopAcq()
+        if self.cb is not None:
+            self.ctrl.unregisterImageStatusCallback(self)
+
+    def imageStatusChanged(self, status):
+        # called from a Lima thread: keep it short
+        self.cb(image_counters(status))
 
     def prepareAcq(self):
         self.ctrl.prepareAcq()
@@ -126,17 +193,115 @@ def configure(ctrl, options):
     buff.setMaxMemory(options.max_buffer_size)
 
 
-def cleanup(ctrl, options):
-    pattern = options.saving_prefix + '*' + options.saving_suffix
-    pattern = pathlib.Path(options.saving_directory) / pattern
-    for filename in glob.glob(str(pattern)):
-        os.remove(filename)
+def saving_suffix(ctrl, options):
+    suffix = options.saving_suffix
+    if suffix == AUTO_SUFFIX:
+        suffix = ctrl.saving().getSuffix()
+    return suffix
+
+
+def cleanup(ctrl, options, prog_bar=None):
+    """
+    Remove the saved files. Returns (nb. files removed, elapsed time) or
+    None if the whole directory was moved aside to be removed in background
+    """
+    directory = options.saving_directory
+    prefix, suffix = options.saving_prefix, saving_suffix(ctrl, options)
+    if options.cleanup_background and only_contains(directory, prefix, suffix):
+        remove_directory_in_background(directory)
+        return
+    if prog_bar is None:
+        progress = None
+    else:
+        counter = prog_bar(label='Removed')
+
+        def progress(n):
+            counter.items_completed = n
+            prog_bar.invalidate()
+    start = time.monotonic()
+    paths = (entry.path for entry in iter_files(directory, prefix, suffix))
+    nb_files = remove_files(paths, options.cleanup_tasks, progress)
+    return nb_files, time.monotonic() - start
+
+
+def verify_saving(ctrl, options):
+    """Read back and check the saved files"""
+    with ReportTask('Verifying'):
+        result = verify(
+            options.saving_directory, options.saving_prefix,
+            saving_suffix(ctrl, options), options.nb_frames,
+            options.saving_nb_frames_per_file, options.verify_tasks,
+        )
+    speed = result.nb_bytes / result.elapsed if result.elapsed > 0 else -1
+    click.echo(
+        f'Verified {result.nb_files} files, {result.nb_frames} frames, '
+        f'{size_text(result.nb_bytes)} (read back: {speed_text(speed)})'
+    )
+    for error in result.errors:
+        print_formatted_text(HTML('<red>Error:</red> {}').format(error))
+    return result
+
+
+def detector_info(ctrl):
+    return ctrl.hwInterface().getHwCtrlObj(Lima.Core.HwCap.DetInfo)
+
+
+def frame_dimension(info):
+    return FrameDim(info.getDetectorImageSize(), info.getCurrImageType())
+
+
+Measurement = collections.namedtuple(
+    "Measurement",
+    "nb_frames prepare_time elapsed fps bandwidth saturation error"
+)
+
+
+def measure(ctrl, options, recorder=None, period=0.01):
+    """
+    Runs a headless acquisition with the current configuration.
+
+    Returns a Measurement with the sustained frame rate (frames which went
+    through the whole pipeline: ready or saved) and bandwidth (bytes/s).
+    saturation is the time (s) after which the acquisition stopped on
+    error (ex: buffer overrun) or None if it completed.
+    """
+    frame_size = frame_dimension(detector_info(ctrl)).getMemSize()
+    with AcquisitionContext(ctrl) as acq_ctx:
+        start = time.monotonic()
+        acq_ctx.prepareAcq()
+        prepare_time = time.monotonic() - start
+        start = time.monotonic()
+        acq_ctx.startAcq()
+        while True:
+            status = acq_ctx.status
+            now = time.monotonic()
+            if recorder is not None:
+                recorder.record(status.ImageCounters, now)
+            if status.AcquisitionStatus != AcqRunning:
+                break
+            if status.Error != Lima.Core.CtControl.NoError:
+                break
+            time.sleep(period)
+    elapsed = now - start
+    counters = status.ImageCounters
+    if options.saving_directory:
+        nb_frames = counters.LastImageSaved + 1
+    else:
+        nb_frames = counters.LastImageReady + 1
+    fps = nb_frames / elapsed if elapsed > 0 else 0.0
+    if status.Error != Lima.Core.CtControl.NoError:
+        saturation, error = elapsed, ErrorMap[status.Error]
+    else:
+        saturation, error = None, None
+    return Measurement(
+        nb_frames, prepare_time, elapsed, fps, fps * frame_size, saturation, error
+    )
 
 
 def AcquisitionProgressBar(ctrl, options, **kwargs):
-    iface = ctrl.hwInterface()
-    info = iface.getHwCtrlObj(Lima.Core.HwCap.DetInfo)
-    frame_dim = FrameDim(info.getDetectorImageSize(), info.getCurrImageType())
+    info = detector_info(ctrl)
+    frame_dim = frame_dimension(info)
+    ur = unit_registry()
     exposure_time = options.exposure_time * ur.second
     latency_time = options.latency_time * ur.second
     frame_time = exposure_time + latency_time
@@ -152,48 +317,217 @@ def AcquisitionProgressBar(ctrl, options, **kwargs):
             f'{options.nb_frames} x {frame_time_str}({frame_rate:~.4}) = {acq_time:~.4}  | ' \
             f'{frame_dim}'
     kwargs["title"] = title
+    progress = options.progress.lower()
+    if progress == 'jsonl':
+        return JsonlProgress(period=1 / options.progress_rate, **kwargs)
+    elif progress == 'none':
+        return NullProgress(**kwargs)
     return ProgressBar(**kwargs)
 
 
+@contextlib.contextmanager
+def messages_to_stderr():
+    """send messages (prompt_toolkit, print and click.echo) to stderr"""
+    with create_app_session(output=create_output(stdout=sys.stderr)):
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+
+
+SavingStatistics = collections.namedtuple(
+    "SavingStatistics",
+    "saving_speed compression_speed compression_ratio incoming_speed"
+)
+
+
+def saving_statistics(ctrl):
+    """Current CtSaving statistics (speeds in bytes/s, -1 if not available)"""
+    return SavingStatistics(*ctrl.saving().getStatisticCounters())
+
+
+def size_text(size):
+    ur = unit_registry()
+    return '{:~.4}'.format((float(size) * ur.byte).to_compact())
+
+
+def speed_text(speed):
+    if speed < 0:
+        return 'n/a'
+    ur = unit_registry()
+    return '{:~.4}'.format((speed * ur.byte / ur.second).to_compact())
+
+
+def saving_statistics_text(stats):
+    ratio = 'n/a' if stats.compression_ratio < 0 else f'{stats.compression_ratio:.2f}'
+    return (
+        f'write: {speed_text(stats.saving_speed)} | '
+        f'incoming: {speed_text(stats.incoming_speed)} | '
+        f'compression: {speed_text(stats.compression_speed)} (ratio {ratio})'
+    )
+
+
+class SavingStatisticsRows:
+    """
+    Saving statistics as extra progress bar rows (in MB/s).
+
+    Write and compression speeds are displayed against the incoming speed
+    so a full bar means saving keeps up with the detector.
+    """
+
+    PERIOD = 0.5
+
+    def __init__(self, ctrl, prog_bar):
+        self.ctrl = ctrl
+        self.prog_bar = prog_bar
+        self.stats = None
+        self.last_read = 0
+        self.write = prog_bar(label='Write MB/s')
+        self.compression = prog_bar(label=self.compression_label)
+        self.incoming = prog_bar(label='Incoming MB/s')
+
+    def compression_label(self):
+        if self.stats is None or self.stats.compression_ratio < 0:
+            return 'Compress MB/s'
+        return f'Compress MB/s x{self.stats.compression_ratio:.1f}'
+
+    def update(self, force=False):
+        """read the statistics (at most every PERIOD). True if rows changed"""
+        now = time.monotonic()
+        if not force and now - self.last_read < self.PERIOD:
+            return False
+        self.last_read = now
+        self.stats = stats = saving_statistics(self.ctrl)
+        incoming = None
+        if stats.incoming_speed >= 0:
+            incoming = round(stats.incoming_speed / 1e6)
+        for bar, speed in ((self.write, stats.saving_speed),
+                           (self.compression, stats.compression_speed),
+                           (self.incoming, stats.incoming_speed)):
+            if speed >= 0:
+                bar.items_completed = round(speed / 1e6)
+        self.write.total = self.compression.total = incoming
+        return True
+
+
 class AcquisitionMonitor:
-    def __init__(self, ctx, prog_bar, options):
+
+    # period at which the acquisition status is checked in event mode
+    STATUS_PERIOD = 0.25
+
+    def __init__(self, ctx, prog_bar, options, queue=None, recorder=None, name=None):
         self.ctx = ctx
-        nb_frames = options.nb_frames
+        self.queue = queue
+        self.recorder = recorder
+        self.name = name
+        self.nb_frames = nb_frames = options.nb_frames
         self.prog_bar = prog_bar
-        self.acq_counter = prog_bar(label='Acquired', total=nb_frames)
-        self.base_counter = prog_bar(label='Base Ready', total=nb_frames)
-        self.img_counter = prog_bar(label='Ready', total=nb_frames)
+        prefix = '' if name is None else name + ' '
+        self.acq_counter = prog_bar(label=prefix + 'Acquired', total=nb_frames)
+        self.base_counter = prog_bar(label=prefix + 'Base Ready', total=nb_frames)
+        self.img_counter = prog_bar(label=prefix + 'Ready', total=nb_frames)
         if options.saving_directory:
-            self.save_counter = prog_bar(label='Saved', total=nb_frames)
+            self.save_counter = prog_bar(label=prefix + 'Saved', total=nb_frames)
         else:
             self.save_counter = None
+        if options.saving_directory and options.saving_statistics_history_size:
+            self.saving_stats = SavingStatisticsRows(ctx.ctrl, prog_bar)
+        else:
+            self.saving_stats = None
+        # redraw coalescing: counters only mark the display dirty
+        self.refresh_period = 1 / options.refresh_rate
+        self.next_redraw = 0
+        self.dirty = False
+        app = getattr(prog_bar, 'app', None)
+        if app is not None:
+            app.min_redraw_interval = self.refresh_period
 
     def set_items_completed(self, bar, n):
-        bar.items_completed = n
-        self.prog_bar.invalidate()
+        if bar.items_completed != n:
+            bar.items_completed = n
+            self.dirty = True
 
-    def update(self, status):
-        counters = status.ImageCounters
+    def redraw(self, force=False):
+        """
+        invalidate the display if something changed, at most once per
+        refresh period
+        """
+        if not self.dirty:
+            return
+        now = time.monotonic()
+        if force or now >= self.next_redraw:
+            self.prog_bar.invalidate()
+            self.dirty = False
+            self.next_redraw = now + self.refresh_period
+
+    def update_counters(self, counters):
+        if self.recorder is not None:
+            self.recorder.record(counters)
         self.set_items_completed(self.acq_counter, counters.LastImageAcquired + 1)
         self.set_items_completed(self.base_counter, counters.LastBaseImageReady + 1)
         self.set_items_completed(self.img_counter, counters.LastImageReady + 1)
         if self.save_counter:
             self.set_items_completed(self.save_counter, counters.LastImageSaved + 1)
+        self.redraw()
+
+    def is_complete(self, counters):
+        if self.nb_frames <= 0:
+            return False
+        if self.save_counter:
+            last = counters.LastImageSaved
+        else:
+            last = counters.LastImageReady
+        return last + 1 >= self.nb_frames
+
+    def update(self, status):
+        if self.saving_stats is not None and self.saving_stats.update():
+            self.dirty = True
+        self.update_counters(status.ImageCounters)
         acq = status.AcquisitionStatus
+        prefix = '' if self.name is None else f'{self.name}: '
+        set_status = getattr(self.prog_bar, 'set_status', None)
+        if set_status is not None:
+            error = None
+            if status.Error != Lima.Core.CtControl.NoError:
+                error = ErrorMap[status.Error]
+            set_status(AcqStatusMap.get(acq, str(acq)), error)
         if status.Error != Lima.Core.CtControl.NoError:
             error = ErrorMap[status.Error]
-            print_formatted_text(HTML(f'<red>Acquisition error: </red> <b>{error}</b>'))
+            print_formatted_text(HTML(
+                f'{prefix}<red>Acquisition error: </red> <b>{error}</b>'
+            ))
         elif acq == AcqFault:
-            print_formatted_text(HTML(f'<orange>Acquisition fault</orange>'))
+            print_formatted_text(HTML(f'{prefix}<orange>Acquisition fault</orange>'))
         return acq == AcqRunning and status.Error == Lima.Core.CtControl.NoError
 
     def run(self):
+        if self.queue is None:
+            self.run_polling()
+        else:
+            self.run_events()
+        self.update(self.ctx.status)
+        self.redraw(force=True)
+
+    def run_polling(self):
         while True:
             status = self.ctx.status
             if not self.update(status):
                 break
             time.sleep(0.05)
-        self.update(self.ctx.status)
+
+    def run_events(self):
+        # counters come from the image status callback. The status is only
+        # checked from time to time to detect errors and stop requests
+        next_check = time.monotonic() + self.STATUS_PERIOD
+        while True:
+            counters = self.queue.get(timeout=self.STATUS_PERIOD)
+            if counters is not None:
+                self.update_counters(counters)
+                if self.is_complete(counters):
+                    break
+            now = time.monotonic()
+            if counters is None or now >= next_check:
+                next_check = now + self.STATUS_PERIOD
+                if not self.update(self.ctx.status):
+                    break
 
 
 def frame_type(text):
@@ -203,6 +537,256 @@ def frame_type(text):
 AUTO_SUFFIX = '__AUTO_SUFFIX__'
 
 
+class Options:
+    def __init__(self, opts):
+        self.__dict__.update(opts)
+
+
+def measure_saving_rates(options, frame_size, frame_rate):
+    """
+    {frames per file: saving rate (frames/s)} measured on the saving
+    directory for the configured frames per file and, if it is not enough,
+    for bigger ones
+    """
+    nb = options.saving_nb_frames_per_file
+    candidates = sorted({nb, nb * 4, nb * 16})
+    if options.nb_frames > 0:
+        candidates = [i for i in candidates if i == nb or i <= options.nb_frames]
+    rates = {}
+    for nb in candidates:
+        with ReportTask(f'Measuring write speed ({nb} frames/file)'):
+            speed = measure_write_speed(
+                options.saving_directory, frame_size * nb,
+                options.nb_saving_tasks, options.preflight_duration
+            )
+        rates[nb] = speed / frame_size
+        if rates[nb] >= frame_rate:
+            break
+    return rates
+
+
+def dry_run(ctrl, options):
+    """Show buffer usage, predicted overruns and how to avoid them"""
+    info = detector_info(ctrl)
+    frame_dim = frame_dimension(info)
+    frame_size = frame_dim.getMemSize()
+    frame_time = options.exposure_time + options.latency_time
+    if frame_time <= 0:
+        raise click.UsageError('dry run needs exposure + latency time > 0')
+    frame_rate = 1 / frame_time
+    memory = plan.total_memory()
+    nb_buffer_frames = plan.buffer_frames(frame_size, options.max_buffer_size, memory)
+
+    saving_rate, rates = None, {}
+    if options.saving_directory:
+        if options.saving_speed:
+            saving_rate = options.saving_speed * 1e6 / frame_size
+        else:
+            rates = measure_saving_rates(options, frame_size, frame_rate)
+            saving_rate = rates[options.saving_nb_frames_per_file]
+    processing_rate = options.processing_speed
+
+    nb_frames = options.nb_frames or 'endless'
+    click.echo(f'Frame: {frame_dim} ({size_text(frame_size)}) x {nb_frames} '
+               f'at {frame_rate:.1f} fps = {speed_text(frame_size * frame_rate)}')
+    click.echo(f'Buffer: {nb_buffer_frames} frames ({options.max_buffer_size}% of '
+               f'{size_text(memory)})')
+    for name, rate in (('Saving', saving_rate), ('Processing', processing_rate)):
+        if rate is not None:
+            click.echo(f'{name}: {rate:.1f} fps ({speed_text(rate * frame_size)})')
+    result = plan.overflow(
+        options.nb_frames, frame_rate, nb_buffer_frames, saving_rate, processing_rate
+    )
+    if result is None:
+        click.echo('Prediction: no overrun')
+        return
+    error = 'SaveOverun' if result.stage == 'saving' else 'ProcessingOverun'
+    click.echo(f'Prediction: {error} after {result.time:.1f} s (frame {result.frame})')
+    click.echo('Suggestions:')
+    for option, value, reason in plan.suggestions(
+        options.nb_frames, frame_rate, frame_size, options.nb_saving_tasks,
+        options.nb_processing_tasks, saving_rate, processing_rate, memory
+    ):
+        click.echo(f'  {option} {value} ({reason})')
+    nb = plan.frames_per_file(frame_rate, rates)
+    if nb is not None and nb != options.saving_nb_frames_per_file:
+        click.echo(f'  --saving-nb-frames-per-file {nb} (measured {rates[nb]:.1f} fps)')
+
+
+def required_bandwidth(ctrl, options):
+    """data rate (bytes/s) produced by the detector with the given options"""
+    frame_time = options.exposure_time + options.latency_time
+    if frame_time <= 0:
+        return None
+    return frame_dimension(detector_info(ctrl)).getMemSize() / frame_time
+
+
+def preflight(ctrl, options):
+    """
+    Compare the write speed of the saving directory with the required data
+    rate. Warns or raises a ClickException (--preflight=refuse) if the disk
+    can't keep up.
+    """
+    required = required_bandwidth(ctrl, options)
+    frame_size = frame_dimension(detector_info(ctrl)).getMemSize()
+    file_size = frame_size * options.saving_nb_frames_per_file
+    with ReportTask('Checking disk bandwidth'):
+        speed = measure_write_speed(
+            options.saving_directory, file_size,
+            options.nb_saving_tasks, options.preflight_duration
+        )
+    message = f'disk: {speed_text(speed)} | required: '
+    message += 'n/a' if required is None else speed_text(required)
+    if required is None or speed >= required:
+        print_formatted_text(HTML(f'<green>Disk bandwidth OK</green> ({message})'))
+    elif options.preflight.lower() == 'refuse':
+        raise click.ClickException(f'disk too slow ({message})')
+    else:
+        print_formatted_text(HTML(f'<orange>Disk too slow</orange> ({message})'))
+
+
+def measure_processing(ctrl):
+    """
+    (median base ready -> ready latency (s), ready fps) of an acquisition
+    with the current configuration. Counters come from image status events
+    so the latency resolution is not limited by a polling period
+    """
+    recorder = TimelineRecorder()
+    with AcquisitionContext(ctrl, recorder.record) as acq_ctx:
+        acq_ctx.prepareAcq()
+        acq_ctx.startAcq()
+        while acq_ctx.status.AcquisitionStatus == AcqRunning:
+            time.sleep(0.01)
+    latency = percentile(recorder.latencies('base_ready', 'ready'), 50)
+    return latency, recorder.throughput('ready')
+
+
+def processing_cost(ctrl, stages):
+    """
+    Install the processing stages one by one and measure the per frame
+    cost of each (increase of the base ready -> ready latency). Saving is
+    disabled during the measurements
+    """
+    saving = ctrl.saving()
+    mode = saving.getSavingMode()
+    saving.setSavingMode(SavingMode['manual'])
+    rows = []
+    try:
+        with ReportTask('Measuring processing (no stage)'):
+            rows.append(('no stage',) + measure_processing(ctrl))
+        for index, stage in enumerate(stages):
+            install(ctrl, [stage], index)
+            with ReportTask(f'Measuring processing (+ {stage.name})'):
+                rows.append((stage.name,) + measure_processing(ctrl))
+    finally:
+        saving.setSavingMode(mode)
+    click.echo('Processing cost (median base ready -> ready latency per frame):')
+    size = max(len(row[0]) for row in rows)
+    previous = None
+    for name, latency, fps in rows:
+        line = f'  {name:<{size}} {latency * 1e3:8.3f} ms'
+        if previous is not None:
+            line += f' ({(latency - previous) * 1e3:+.3f} ms)'
+        click.echo(line + f' | {fps:.1f} fps')
+        previous = latency
+    return rows
+
+
+def run_autotune(ctrl, options, key):
+    """
+    Search (hill climbing over short probe acquisitions) the saving and
+    processing tasks and frames per file which sustain the frame rate with
+    the least CPU. The result is stored for --tuned and applied to options.
+    Probes save in a scratch sub-directory of the saving directory
+    """
+    frame_time = options.exposure_time + options.latency_time
+    frame_rate = 1 / frame_time if frame_time > 0 else float('inf')
+    probe_options = Options(dict(
+        options.__dict__, nb_frames=options.autotune_frames,
+        saving_policy='overwrite', cleanup_background=False,
+    ))
+
+    def probe(config):
+        probe_options.__dict__.update(config)
+        with ReportTask('Probing ' + autotune.config_text(config)):
+            configure(ctrl, probe_options)
+            # process CPU time: includes the Lima processing and saving threads
+            cpu = time.process_time()
+            try:
+                result = measure(ctrl, probe_options)
+            finally:
+                cpu = time.process_time() - cpu
+                if probe_options.saving_directory:
+                    cleanup(ctrl, probe_options)
+        cpu_per_frame = cpu / max(result.nb_frames, 1)
+        click.echo(f'  {result.fps:.1f} fps | {cpu_per_frame * 1e3:.3f} ms CPU/frame'
+                   + (f' | {result.error}' if result.error else ''))
+        return autotune.Probe(config, result.fps, cpu_per_frame, result.error)
+
+    ladders = autotune.ladders(bool(options.saving_directory))
+    start = {name: getattr(options, name) for name, _ in ladders}
+    with contextlib.ExitStack() as stack:
+        if options.saving_directory:
+            probe_options.saving_directory = stack.enter_context(
+                scratch_directory(options.saving_directory, 'autotune')
+            )
+        probes = autotune.hill_climb(probe, start, ladders)
+    best = autotune.choose(probes, frame_rate)
+    if best is None:
+        print_formatted_text(HTML(
+            '<red>All autotune probes failed:</red> keeping the given configuration'
+        ))
+        configure(ctrl, options)
+        return
+    if best.fps < frame_rate * 0.98:
+        print_formatted_text(HTML(
+            f'<orange>No configuration sustains {frame_rate:.1f} fps</orange>'
+        ))
+    click.echo(f'Tuned: {autotune.config_text(best.config)} ({best.fps:.1f} fps)')
+    autotune.store(key, options.saving_format, best, frame_rate)
+    options.__dict__.update(best.config)
+    configure(ctrl, options)
+
+
+def apply_tuned(options, key):
+    tuned = autotune.load(key, options.saving_format)
+    if tuned is None:
+        print_formatted_text(HTML(
+            f'<orange>No tuned configuration for {options.saving_format}: '
+            f'use --autotune first</orange>'))
+        return
+    config = {name: tuned[name] for name, _ in autotune.LADDERS if name in tuned}
+    options.__dict__.update(config)
+    click.echo(f'Using tuned configuration: {autotune.config_text(config)}')
+
+
+def run_soak(ctrl, options):
+    """
+    Repeated headless acquisitions on the same CtControl. Reports prepare
+    time, fps and process memory of every iteration and flags throughput
+    drift or memory growth
+    """
+    recorder = SoakRecorder(options.soak_window)
+    repeat = options.repeat if options.repeat > 1 else 0
+    try:
+        for index in iterations(repeat, options.duration):
+            result = measure(ctrl, options)
+            if options.cleanup and options.saving_directory:
+                cleanup(ctrl, options)
+            iteration = recorder.add(result, rss())
+            click.echo(recorder.iteration_text(iteration))
+    except KeyboardInterrupt:
+        print("Ctrl-C pressed")
+    click.echo(recorder.summary_text())
+    warnings = recorder.warnings(
+        options.drift_tolerance / 100, options.leak_tolerance * 1e6
+    )
+    for warning in warnings:
+        print_formatted_text(HTML(f'<orange>Warning:</orange> {warning}'))
+    if not warnings and len(recorder.iterations) >= 2 * options.soak_window:
+        print_formatted_text(HTML('<green>No degradation detected</green>'))
+
+
 @click.command("acquire")
 @click.option('-n', '--nb-frames', default=10, type=int, show_default=True)
 @click.option('-e', '--exposure-time', default=0.1, type=float, show_default=True)
@@ -239,7 +823,9 @@ AUTO_SUFFIX = '__AUTO_SUFFIX__'
 )
 @click.option('-p', '--saving-prefix', default='image_', type=str, show_default=True)
 @click.option('-s', '--saving-suffix', default=AUTO_SUFFIX, type=str, show_default=True)
-@click.option('--saving-statistics-history-size', default=0, type=int, show_default=True)
+@click.option('--saving-statistics-history-size', default=0, type=int,
+              show_default=True,
+              help='enable saving statistics (live and final report)')
 @click.option(
     '--frame-type', type=frame_type, default='Bpp16', show_default=True,
     help='pixel format (ex: Bpp8)')
@@ -249,20 +835,119 @@ AUTO_SUFFIX = '__AUTO_SUFFIX__'
               help='nb. of saving tasks')
 @click.option('--nb-processing-tasks', type=int, default=2, show_default=True,
               help='nb. of processing tasks')
+@click.option(
+    '--preflight', default='off', show_default=True,
+    type=click.Choice(['off', 'warn', 'refuse'], case_sensitive=False),
+    help='measure the saving directory write speed before the acquisition '
+         'and warn or refuse if it is below the required data rate'
+)
+@click.option('--preflight-duration', type=float, default=2.0, show_default=True,
+              help='duration of the write speed measurement (s)')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='show the buffer plan and predicted overruns, do not acquire')
+@click.option('--saving-speed', type=float, default=None,
+              help='saving speed (MB/s) used by --dry-run (default: measured)')
+@click.option('--processing-speed', type=float, default=None,
+              help='processing speed (frames/s) used by --dry-run (default: unlimited)')
+@click.option('--roi-counter', type=roi, multiple=True,
+              help='processing: ROI counter <x>,<y>,<width>,<height> '
+                   '(repeat for several)')
+@click.option('--soft-binning', type=binning, default=None,
+              help='processing: software binning <x>x<y>')
+@click.option('--background', type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help='processing: background image to subtract (EDF or .npy)')
+@click.option('--flatfield', type=click.Path(exists=True, dir_okay=False),
+              default=None, help='processing: flat-field image (EDF or .npy)')
+@click.option('--processing-cost/--no-processing-cost', default=False,
+              help='before the acquisition, measure the per frame cost of each '
+                   'processing stage (stages are added one at a time)')
+@click.option('--autotune', is_flag=True, default=False,
+              help='search the nb. of saving/processing tasks and frames per '
+                   'file sustaining the frame rate with the least CPU (stored '
+                   'per detector and format) before the acquisition')
+@click.option('--autotune-frames', type=int, default=200, show_default=True,
+              help='nb. of frames of each autotune probe acquisition')
+@click.option('--tuned', is_flag=True, default=False,
+              help='use the configuration stored by a previous --autotune')
+@click.option('--verify/--no-verify', default=False,
+              help='after saving, read back the files and check the nb. of '
+                   'files, frames, headers and sizes')
+@click.option('--verify-tasks', type=int, default=4, show_default=True,
+              help='nb. of files verified concurrently')
+@click.option('--repeat', type=int, default=1, show_default=True,
+              help='soak mode: repeat the acquisition N times (reusing the '
+                   'same control) and track fps and memory across iterations')
+@click.option('--duration', type=float, default=0, show_default=True,
+              help='soak mode: repeat the acquisition during this time (s)')
+@click.option('--soak-window', type=click.IntRange(1), default=5, show_default=True,
+              help='soak mode: nb. of iterations averaged to detect drifts')
+@click.option('--drift-tolerance', type=float, default=5, show_default=True,
+              help='soak mode: fps drift (%) above which a warning is given')
+@click.option('--leak-tolerance', type=float, default=10, show_default=True,
+              help='soak mode: memory growth (MB) above which a warning is given')
 @click.option('--cleanup/--no-cleanup', default=False,
               help='do not cleanup saving directory')
+@click.option('--cleanup-tasks', type=int, default=8, show_default=True,
+              help='nb. of concurrent file removals on cleanup')
+@click.option('--cleanup-background/--no-cleanup-background', default=False,
+              help='on cleanup, if the saving directory only contains the saved '
+                   'files, move it aside and remove it in background')
+@click.option(
+    '--monitor', default='poll', show_default=True,
+    type=click.Choice(['poll', 'event'], case_sensitive=False),
+    help='poll status periodically or follow image status events'
+)
+@click.option('--timeline/--no-timeline', default=False,
+              help='record per frame stage timeline and show latency statistics')
+@click.option('--timeline-file', default=None, type=click.Path(dir_okay=False),
+              help='save raw timeline (CSV if *.csv, binary otherwise)')
+@click.option('--refresh-rate', type=click.FloatRange(min=0.1),
+              default=10, show_default=True,
+              help='maximum progress display refreshes per second')
+@click.option(
+    '--progress', default='tui', show_default=True,
+    type=click.Choice(['tui', 'jsonl', 'none'], case_sensitive=False),
+    help='progress display: terminal UI, JSON lines records (messages go to '
+         'stderr) or nothing (ex: batch jobs without a TTY)'
+)
+@click.option('--progress-file', default=None, type=click.Path(dir_okay=False),
+              help='jsonl progress destination (default: stdout)')
+@click.option('--progress-rate', type=click.FloatRange(min=0, min_open=True),
+              default=1, show_default=True,
+              help='jsonl progress records per second')
+@click.option('--frame-stats/--no-frame-stats', default=False,
+              help='show live statistics (min, max, mean, saturated pixels, '
+                   'histogram) of the last ready frame')
+@click.option('--frame-stats-rate', type=click.FloatRange(min=0, min_open=True),
+              default=2, show_default=True,
+              help='maximum frame statistics computations per second')
+@click.option('--saturation-level', type=int, default=None,
+              help='pixel value considered saturated (default: pixel type maximum)')
 @click.pass_context
 def acquire(ctx, **kwargs):
     """Executes an acquisition"""
     interface = ctx.obj["interface"]
     if interface is None:
         raise click.UsageError("missing detector", ctx)
-    class Options:
-        def __init__(self, opts):
-            self.__dict__.update(opts)
-
     options = Options(kwargs)
+    if options.progress.lower() == 'tui':
+        return run_acquisition(ctx, interface, options)
+    with contextlib.ExitStack() as stack:
+        if options.progress_file:
+            output = stack.enter_context(open(options.progress_file, 'w'))
+        else:
+            output = sys.stdout
+        stack.enter_context(messages_to_stderr())
+        return run_acquisition(ctx, interface, options, output)
+
 
+def run_acquisition(ctx, interface, options, output=None):
+    """
+    acquire command body. Non TUI progress records go to output (messages
+    are expected to be redirected to stderr by the caller)
+    """
+    tui = options.progress.lower() == 'tui'
     kb = KeyBindings()
 
     @kb.add('x')
@@ -286,28 +971,102 @@ def acquire(ctx, **kwargs):
         def _(event):
             ctrl.saving().writeFrame()
 
+    if options.tuned:
+        apply_tuned(options, camera_key(ctx.obj))
     with ReportTask('Initializing'):
         ctrl = Lima.Core.CtControl(interface)
     with ReportTask('Configuring'):
         configure(ctrl, options)
+    if options.dry_run:
+        dry_run(ctrl, options)
+        return
+    stages = processing_stages(options)
+    if options.processing_cost:
+        if options.nb_frames <= 0:
+            raise click.UsageError('processing cost needs a finite --nb-frames', ctx)
+        processing_cost(ctrl, stages)
+    elif stages:
+        with ReportTask('Installing processing'):
+            install(ctrl, stages)
+    if options.autotune:
+        run_autotune(ctrl, options, camera_key(ctx.obj))
+    if options.saving_directory and options.preflight.lower() != 'off':
+        preflight(ctrl, options)
+    if options.repeat > 1 or options.duration > 0:
+        if options.nb_frames <= 0:
+            raise click.UsageError('soak mode needs a finite --nb-frames', ctx)
+        run_soak(ctrl, options)
+        return
+    record = options.timeline or options.timeline_file is not None
+    recorder = None
+    if options.monitor.lower() == 'event':
+        queue = StatusQueue()
+        callback = queue.put
+    else:
+        queue = callback = None
     try:
-        with AcquisitionContext(ctrl) as acq_ctx:
+        with AcquisitionContext(ctrl, callback) as acq_ctx:
             with ReportTask('Preparing'):
                 acq_ctx.prepareAcq()
             with ReportTask('Acquiring', end='\n'):
-                prog_bar = AcquisitionProgressBar(ctrl, options,
-                    bottom_toolbar=HTML(tb_message),
-                    key_bindings=kb,
-                )
+                if tui:
+                    prog_bar = AcquisitionProgressBar(ctrl, options,
+                        bottom_toolbar=HTML(tb_message),
+                        key_bindings=kb,
+                    )
+                else:
+                    prog_bar = AcquisitionProgressBar(ctrl, options, file=output)
                 with prog_bar:
+                    recorder = TimelineRecorder() if record else None
+                    if options.frame_stats:
+                        frame_stats = FrameStatisticsMonitor(
+                            ctrl, options.frame_stats_rate, options.saturation_level
+                        )
+                        prog_bar(label=frame_stats.label)
+                    else:
+                        frame_stats = None
                     acq_ctx.startAcq()
-                    monitor = AcquisitionMonitor(acq_ctx, prog_bar, options)
-                    monitor.run()
+                    monitor = AcquisitionMonitor(
+                        acq_ctx, prog_bar, options, queue, recorder
+                    )
+                    with frame_stats or contextlib.nullcontext():
+                        monitor.run()
+            if frame_stats is not None:
+                click.echo('Last frame: ' + statistics_text(frame_stats.stats))
+            if monitor.saving_stats is not None:
+                stats = saving_statistics(ctrl)
+                click.echo('Saving statistics: ' + saving_statistics_text(stats))
+            if recorder is not None:
+                click.echo(recorder.summary_text())
+                if options.timeline_file:
+                    with ReportTask('Saving timeline'):
+                        recorder.save(options.timeline_file)
+            if options.verify and options.saving_directory and options.nb_frames > 0:
+                verify_saving(ctrl, options)
     except KeyboardInterrupt:
         print("Ctrl-C pressed")
     finally:
-        with ReportTask('Cleaning up') as task:
-            if options.cleanup and options.saving_directory:
-                cleanup(ctrl, options)
-            else:
+        if options.cleanup and options.saving_directory:
+            with ReportTask('Cleaning up', end='\n'):
+                with (ProgressBar() if tui else NullProgress()) as prog_bar:
+                    result = cleanup(ctrl, options, prog_bar)
+                if result is None:
+                    print_formatted_text(
+                        'Saving directory moved aside: removing in background'
+                    )
+                else:
+                    nb_files, elapsed = result
+                    speed = nb_files / elapsed if elapsed > 0 else 0
+                    print_formatted_text(
+                        f'Removed {nb_files} files ({speed:.0f} files/s)'
+                    )
+        else:
+            with ReportTask('Cleaning up') as task:
                 task.skip()
+
+
+def default_options(**kwargs):
+    """acquire default options updated with the given ones"""
+    opts = {param.name: param.default for param in acquire.params}
+    opts.update(kwargs)
+    return Options(opts)
@@ -0,0 +1,108 @@
+"""
+Automatic tuning of the acquisition pipeline parameters.
+
+A hill climbing search probes short acquisitions: starting from the given
+configuration it moves to the neighbour (one parameter one step up or down
+its ladder) with the best throughput until throughput stops improving.
+Among all the probed configurations the one which sustains the requested
+frame rate with the least CPU per frame is chosen.
+"""
+
+import collections
+
+from .cache import Cache
+
+# tunable parameters and the values they can take
+LADDERS = (
+    ("nb_saving_tasks", (1, 2, 4, 8, 16)),
+    ("nb_processing_tasks", (1, 2, 4, 8, 16)),
+    ("saving_nb_frames_per_file", (1, 4, 16, 64, 256)),
+)
+
+SAVING_PARAMETERS = {"nb_saving_tasks", "saving_nb_frames_per_file"}
+
+Probe = collections.namedtuple("Probe", "config fps cpu error")
+
+
+def ladders(saving=True):
+    """ladders of the parameters which matter (saving ones only if saving)"""
+    return tuple(
+        (name, values) for name, values in LADDERS
+        if saving or name not in SAVING_PARAMETERS
+    )
+
+
+def nearest(values, value):
+    return min(range(len(values)), key=lambda i: abs(values[i] - value))
+
+
+def neighbours(config, ladders):
+    """configurations with one parameter one step up or down its ladder"""
+    for name, values in ladders:
+        index = nearest(values, config[name])
+        for i in (index - 1, index + 1):
+            if 0 <= i < len(values) and values[i] != config[name]:
+                yield dict(config, **{name: values[i]})
+
+
+def hill_climb(probe, start, ladders, min_gain=0.02, max_probes=30):
+    """
+    Probe configurations (probe(config) -> Probe) climbing towards the best
+    throughput. Stops when no neighbour improves the fps by more than
+    min_gain (fraction) or after max_probes probes. Returns all the probes.
+    """
+    results = {}
+
+    def evaluate(config):
+        key = tuple(sorted(config.items()))
+        if key not in results:
+            results[key] = probe(config)
+        return results[key]
+
+    current = evaluate(start)
+    while len(results) < max_probes:
+        best = current
+        for config in neighbours(current.config, ladders):
+            if len(results) >= max_probes:
+                break
+            result = evaluate(config)
+            if result.error is None and result.fps > best.fps * (1 + min_gain):
+                best = result
+        if best is current:
+            break
+        current = best
+    return list(results.values())
+
+
+def choose(probes, frame_rate, tolerance=0.02):
+    """
+    probe sustaining frame_rate (within tolerance, without error) with the
+    least CPU per frame or, if none does, the error free one with the best
+    fps. None if all probes failed (an acquisition stopped on error, ex:
+    overrun, may show a misleading high fps)
+    """
+    valid = [p for p in probes if p.error is None]
+    sustained = [p for p in valid if p.fps >= frame_rate * (1 - tolerance)]
+    if sustained:
+        return min(sustained, key=lambda p: p.cpu)
+    if valid:
+        return max(valid, key=lambda p: p.fps)
+
+
+def config_text(config):
+    return ", ".join(f"{name}={value}" for name, value in config.items())
+
+
+def tuned_key(camera_key, saving_format):
+    return f"{camera_key}|{saving_format.lower()}"
+
+
+def load(camera_key, saving_format):
+    """stored tuned parameters (None if the detector/format was never tuned)"""
+    timestamp, value = Cache("autotune").entry(tuned_key(camera_key, saving_format))
+    return value
+
+
+def store(camera_key, saving_format, probe, frame_rate):
+    value = dict(probe.config, fps=probe.fps, cpu=probe.cpu, frame_rate=frame_rate)
+    Cache("autotune").set(tuned_key(camera_key, saving_format), value)
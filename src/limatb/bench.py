@@ -0,0 +1,124 @@
+import json
+import itertools
+import contextlib
+
+import click
+import Lima.Core
+
+from .acquire import ReportTask, configure, cleanup, default_options, measure
+from .cli import table_style, max_width
+from .storage import scratch_directory
+from .util import FileFormat
+
+
+SWEEP = (
+    ("exposure_time", "Exposure (s)"),
+    ("saving_format", "Format"),
+    ("saving_nb_frames_per_file", "Frames/file"),
+    ("nb_saving_tasks", "Saving tasks"),
+    ("nb_processing_tasks", "Proc. tasks"),
+)
+
+
+def iter_combinations(**values):
+    """Yield a dict for every combination of the swept parameter values"""
+    names = [name for name, _ in SWEEP]
+    for combination in itertools.product(*(values[name] for name in names)):
+        yield dict(zip(names, combination))
+
+
+def run_combination(ctrl, options):
+    configure(ctrl, options)
+    try:
+        return measure(ctrl, options)
+    finally:
+        if options.saving_directory:
+            cleanup(ctrl, options)
+
+
+def result_table(results):
+    import beautifultable
+    table = beautifultable.BeautifulTable()
+    table.columns.header = [label for _, label in SWEEP] + [
+        "fps", "MB/s", "Saturation (s)", "Error"
+    ]
+    for result in results:
+        row = [result[name] for name, _ in SWEEP]
+        saturation = result["saturation"]
+        row += [
+            "{:.1f}".format(result["fps"]),
+            "{:.1f}".format(result["bandwidth"] / 1e6),
+            "-" if saturation is None else "{:.3f}".format(saturation),
+            result["error"] or "",
+        ]
+        table.rows.append(row)
+    return table
+
+
+@click.command("bench")
+@click.option('-n', '--nb-frames', default=100, type=int, show_default=True,
+              help='nb. of frames of each acquisition')
+@click.option('-e', '--exposure-time', 'exposure_time', type=float,
+              multiple=True, default=[0.01], show_default=True,
+              help='exposure time (repeat to sweep)')
+@click.option('-l', '--latency-time', default=0.0, type=float, show_default=True)
+@click.option('-d', '--saving-directory', default=None, type=str,
+              help='saving directory (no saving if not given). Files are '
+                   'saved in a temporary sub-directory, removed at the end')
+@click.option(
+    '-f', '--saving-format', 'saving_format', multiple=True, default=['EDF'],
+    type=click.Choice(FileFormat, case_sensitive=False), show_default=True,
+    help='saving format (repeat to sweep)'
+)
+@click.option('--saving-nb-frames-per-file', type=int, multiple=True,
+              default=[1], show_default=True,
+              help='nb of frames per file (repeat to sweep)')
+@click.option('--nb-saving-tasks', type=int, multiple=True, default=[1],
+              show_default=True, help='nb. of saving tasks (repeat to sweep)')
+@click.option('--nb-processing-tasks', type=int, multiple=True, default=[2],
+              show_default=True, help='nb. of processing tasks (repeat to sweep)')
+@click.option('--max-buffer-size', type=float, default=50, show_default=True,
+              help='maximum buffer size (% total memory)')
+@click.option('-o', '--output', default='bench.json', show_default=True,
+              type=click.Path(dir_okay=False), help='JSON result file')
+@table_style
+@max_width
+@click.pass_context
+def bench(ctx, output, table_style, max_width, **kwargs):
+    """Benchmarks a matrix of short acquisitions"""
+    interface = ctx.obj["interface"]
+    if interface is None:
+        raise click.UsageError("missing detector", ctx)
+    if kwargs["nb_frames"] <= 0:
+        raise click.BadParameter("must be > 0", ctx, param_hint="'--nb-frames'")
+    sweep = {name: kwargs.pop(name) for name, _ in SWEEP}
+    combinations = list(iter_combinations(**sweep))
+
+    with ReportTask('Initializing'):
+        ctrl = Lima.Core.CtControl(interface)
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        # never overwrite nor remove files which are not from the bench
+        if kwargs["saving_directory"]:
+            kwargs["saving_directory"] = stack.enter_context(
+                scratch_directory(kwargs["saving_directory"], "bench")
+            )
+        try:
+            for i, combination in enumerate(combinations, 1):
+                options = default_options(
+                    saving_policy='overwrite', cleanup_background=False, **kwargs
+                )
+                options.__dict__.update(combination)
+                with ReportTask(f'Run {i}/{len(combinations)}'):
+                    result = run_combination(ctrl, options)
+                results.append(dict(combination, **result._asdict()))
+        except KeyboardInterrupt:
+            print("Ctrl-C pressed")
+
+    table = result_table(results)
+    table.set_style(getattr(table, "STYLE_" + table_style.upper()))
+    table.maxwidth = max_width
+    click.echo(table)
+    with open(output, "w") as fobj:
+        json.dump(results, fobj, indent=2)
@@ -0,0 +1,70 @@
+"""
+Small persistent caches (JSON files in the user cache directory).
+"""
+
+import os
+import json
+import time
+import pathlib
+import tempfile
+
+DEFAULT_TTL = 3600
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return pathlib.Path(base) / "limatb"
+
+
+class Cache:
+    """
+    JSON file backed key/value store.
+
+    Each value is stored with the time it was set so callers can decide
+    whether it is still fresh. Writes are atomic (write + rename) so
+    concurrent processes never see a partially written file.
+    """
+
+    def __init__(self, name, path=None):
+        self.path = pathlib.Path(path) if path else cache_dir() / (name + ".json")
+
+    def load(self):
+        try:
+            with open(self.path) as fobj:
+                data = json.load(fobj)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def dump(self, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=str(self.path.parent), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fobj:
+                json.dump(data, fobj, indent=1, default=str)
+            os.replace(name, str(self.path))
+        except BaseException:
+            os.unlink(name)
+            raise
+
+    def entry(self, key):
+        """(timestamp, value) or (None, None) if key is not in the cache"""
+        item = self.load().get(key)
+        if item is None:
+            return None, None
+        return item["timestamp"], item["value"]
+
+    def get(self, key, ttl=DEFAULT_TTL):
+        """value if younger than ttl seconds, None otherwise"""
+        timestamp, value = self.entry(key)
+        if timestamp is None or time.time() - timestamp > ttl:
+            return None
+        return value
+
+    def set(self, key, value, timestamp=None):
+        data = self.load()
+        timestamp = time.time() if timestamp is None else timestamp
+        data[key] = dict(timestamp=timestamp, value=value)
+        self.dump(data)
@@ -1,8 +1,23 @@
+import itertools
+import collections
+
 import click
 
 from limatb.cli import camera, url, table_style, max_width
 from limatb.util import camera_module
 
+TransportPoint = collections.namedtuple(
+    "TransportPoint", "packet_size inter_packet_delay frame_transmission_delay"
+)
+
+# one acquisition of a transport point: drops are failed buffers + missing frames
+TransportRun = collections.namedtuple("TransportRun", "fps drops error")
+
+TransportResult = collections.namedtuple(
+    "TransportResult", "point fps drops errors"
+)
+
+
 @camera(name="basler")
 @url
 @click.option("--packet-size", default=1500)
@@ -39,3 +54,163 @@ def basler_scan(table_style, max_width):
     table.set_style(style)
     table.max_table_width = max_width
     click.echo(table)
+
+
+def transport_points(packet_sizes, inter_packet_delays, frame_transmission_delays):
+    """grid of transport points (grouped by packet size: it needs a new camera)"""
+    return [
+        TransportPoint(*values) for values in itertools.product(
+            packet_sizes, inter_packet_delays, frame_transmission_delays
+        )
+    ]
+
+
+def sweep_transport(run_point, points, repeat=1, callback=None):
+    """
+    Run repeat acquisitions of each point with run_point(point) ->
+    TransportRun. Returns a TransportResult per point (mean fps, total
+    drops, errors). callback(result) is called after each point
+    """
+    results = []
+    for point in points:
+        runs = [run_point(point) for _ in range(repeat)]
+        result = TransportResult(
+            point, sum(run.fps for run in runs) / len(runs),
+            sum(run.drops for run in runs), [run.error for run in runs if run.error],
+        )
+        results.append(result)
+        if callback is not None:
+            callback(result)
+    return results
+
+
+def best_transport(results):
+    """drop and error free result with the best fps (smallest delays if equal)"""
+    clean = [r for r in results if not r.drops and not r.errors]
+    if not clean:
+        return None
+    return max(
+        clean,
+        key=lambda r: (
+            r.fps, -r.point.inter_packet_delay, -r.point.frame_transmission_delay
+        )
+    )
+
+
+def dropped_frames(failed_before, failed_after, nb_frames, nb_acquired):
+    """failed stream buffers during an acquisition + missing frames"""
+    # statistics may be reset when the acquisition starts
+    if failed_after >= failed_before:
+        failed = failed_after - failed_before
+    else:
+        failed = failed_after
+    return failed + max(nb_frames - nb_acquired, 0)
+
+
+class TransportRunner:
+    """
+    Acquisition layer of tune-transport: short headless acquisitions on a
+    basler camera. The camera is only created again when the packet size
+    changes (delays are changed on the fly)
+    """
+
+    def __init__(self, url, options):
+        self.url = url
+        self.options = options
+        self.packet_size = None
+        self.camera = None
+        self.ctrl = None
+
+    def setup(self, point):
+        import Lima.Core
+        from limatb.acquire import configure
+        if point.packet_size != self.packet_size:
+            Basler = camera_module('Basler')
+            self.ctrl = self.camera = None
+            self.camera = Basler.Camera(self.url, point.packet_size)
+            self.ctrl = Lima.Core.CtControl(Basler.Interface(self.camera))
+            self.packet_size = point.packet_size
+            configure(self.ctrl, self.options)
+        self.camera.setInterPacketDelay(point.inter_packet_delay)
+        self.camera.setFrameTransmissionDelay(point.frame_transmission_delay)
+
+    def __call__(self, point):
+        from limatb.acquire import measure
+        self.setup(point)
+        before = self.camera.getStatisticsFailedBufferCount()
+        result = measure(self.ctrl, self.options)
+        after = self.camera.getStatisticsFailedBufferCount()
+        drops = dropped_frames(before, after, self.options.nb_frames, result.nb_frames)
+        return TransportRun(result.fps, drops, result.error)
+
+
+def transport_table(results, best=None):
+    import beautifultable
+    table = beautifultable.BeautifulTable()
+    table.columns.header = (
+        "Packet size", "IPD", "FTD", "fps", "Drops", "Errors", ""
+    )
+    for result in results:
+        table.rows.append((
+            *result.point, "{:.1f}".format(result.fps), result.drops,
+            "\n".join(sorted(set(result.errors))), "*" if result is best else "",
+        ))
+    return table
+
+
+@basler.command("tune-transport")
+@click.option("--packet-size", "packet_sizes", type=int, multiple=True,
+              default=[1500, 8192], show_default=True,
+              help="packet size (repeat to sweep)")
+@click.option("--inter-packet-delay", "inter_packet_delays", type=int, multiple=True,
+              default=[0, 1000, 4000], show_default=True,
+              help="inter packet delay in ticks (repeat to sweep)")
+@click.option("--frame-transmission-delay", "frame_transmission_delays", type=int,
+              multiple=True, default=[0], show_default=True,
+              help="frame transmission delay in ticks (repeat to sweep)")
+@click.option("-n", "--nb-frames", default=100, type=int, show_default=True,
+              help="nb. of frames of each acquisition")
+@click.option("-e", "--exposure-time", default=0.01, type=float, show_default=True)
+@click.option("-l", "--latency-time", default=0.0, type=float, show_default=True)
+@click.option("--repeat", default=2, type=int, show_default=True,
+              help="nb. of acquisitions per point")
+@table_style
+@max_width
+@click.pass_context
+def basler_tune_transport(
+    ctx, packet_sizes, inter_packet_delays, frame_transmission_delays,
+    repeat, table_style, max_width, **kwargs
+):
+    """sweep the GigE transport parameters and report the best drop free ones"""
+    from limatb.acquire import ReportTask, default_options
+    url = ctx.obj.get("camera_params", {}).get("url")
+    if url is None:
+        raise click.UsageError("missing detector (basler --url)", ctx)
+    points = transport_points(
+        packet_sizes, inter_packet_delays, frame_transmission_delays
+    )
+    runner = TransportRunner(url, default_options(**kwargs))
+
+    def run_point(point):
+        label = "packet {} | ipd {} | ftd {}".format(*point)
+        with ReportTask(label):
+            return runner(point)
+
+    try:
+        results = sweep_transport(run_point, points, repeat)
+    except KeyboardInterrupt:
+        click.echo("Ctrl-C pressed")
+        return
+    best = best_transport(results)
+    table = transport_table(results, best)
+    table.set_style(getattr(table, "STYLE_" + table_style.upper()))
+    table.maxwidth = max_width
+    click.echo(table)
+    if best is None:
+        click.echo("No drop free setting found")
+    else:
+        click.echo(
+            "Best: --packet-size {} --inter-packet-delay {} "
+            "--frame-transmission-delay {}".format(*best.point)
+            + " ({:.1f} fps)".format(best.fps)
+        )
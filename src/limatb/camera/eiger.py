@@ -1,13 +1,34 @@
+import sys
+import json
+import time
 import asyncio
+import subprocess
+import collections
 import urllib.parse
 
 import click
+import aiodns
 
-from limatb.cli import camera, url, table_style, max_width
+from limatb.cli import camera, url, table_style, max_width, cache_ttl, refresh
 from limatb.util import camera_module
-from limatb.network import get_subnet_addresses, get_host_by_addr
+from limatb.cache import Cache, DEFAULT_TTL
+from limatb.network import Host, get_host, open_hosts
 
 DEFAULT_HTTP_PORT = 8000
+DEFAULT_CONCURRENCY = 128
+DEFAULT_REQUEST_TIMEOUT = 0.5
+# fraction of the scan timeout reserved for the reverse DNS lookups
+DNS_TIMEOUT_SHARE = 0.2
+
+# SIMPLON API sections of a configuration snapshot (<subsystem>/<kind>)
+CONFIG_SECTIONS = (
+    "detector/config", "detector/status", "stream/config", "stream/status",
+)
+# sections compared by default by config diff (status values always change)
+DIFF_SECTIONS = ("detector/config", "stream/config")
+# big array values skipped unless explicitly requested
+ARRAY_KEYS = ("flatfield", "pixel_mask")
+DEFAULT_CONFIG_TIMEOUT = 5.0
 
 
 @camera(name="eiger")
@@ -26,39 +47,197 @@ def eiger(url):
     return interface
 
 
-async def find_detectors(port=DEFAULT_HTTP_PORT, timeout=2.0):
+Detector = collections.namedtuple("Detector", "host port version address")
+
+
+def http_session(
+    concurrency=DEFAULT_CONCURRENCY, request_timeout=DEFAULT_REQUEST_TIMEOUT
+):
+    """aiohttp session with a bounded connection pool and short timeouts"""
     import aiohttp
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(
+        sock_connect=request_timeout, sock_read=request_timeout
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=client_timeout)
 
-    async def get(addr):
-        async with aiohttp.ClientSession() as session:
-            try:
-                r = await session.get(
-                    f"http://{addr}:{port}/detector/api/version/")
-                if r.status != 200:
-                    return
-                version = (await r.json())['value']
-            except Exception:
+
+async def get_version(session, addr, port=DEFAULT_HTTP_PORT):
+    """(addr, API version) or None if addr doesn't look like an eiger"""
+    try:
+        url = f"http://{addr}:{port}/detector/api/version/"
+        async with session.get(url) as r:
+            if r.status != 200:
                 return
+            return addr, (await r.json())['value']
+    except Exception:
+        return
+
+
+async def iter_versions(addresses, port=DEFAULT_HTTP_PORT, timeout=2.0, **kwargs):
+    """
+    yield (addr, API version) as soon as an address answers. addresses can
+    also be an async iterable (ex: the open hosts of a TCP sweep): each
+    address is queried as soon as it comes
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    answers = asyncio.Queue()
+    done = object()
+    tasks = []
+    async with http_session(**kwargs) as session:
+
+        async def query(addr):
+            await answers.put(await get_version(session, addr, port))
+
+        async def feed():
             try:
-                host = await get_host_by_addr(addr)
-            except:
-                class host:
-                    name = addr
-                    aliases = []
-                    addresses = [addr]
-            return host, port, version
-
-    detectors = []
-    addresses = get_subnet_addresses()
-    coros = [get(host) for host in addresses]
+                if hasattr(addresses, "__aiter__"):
+                    async for addr in addresses:
+                        tasks.append(asyncio.create_task(query(addr)))
+                else:
+                    tasks.extend(asyncio.create_task(query(addr)) for addr in addresses)
+                await asyncio.gather(*tasks)
+            finally:
+                answers.put_nowait(done)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            while True:
+                answer = await asyncio.wait_for(answers.get(), deadline - loop.time())
+                if answer is done:
+                    await feeder  # raises the feed error, if any
+                    break
+                if answer is not None:
+                    yield answer
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks + [feeder]:
+                task.cancel()
+
+
+async def iter_detectors(port=DEFAULT_HTTP_PORT, timeout=2.0, addresses=None, **kwargs):
+    """
+    yield detectors as soon as they answer. Only the hosts with the port
+    open (TCP connect sweep, shared with the other plugins during a global
+    scan) get the API version query. The reverse DNS lookup runs (sharing
+    one resolver) only for the addresses which answered and doesn't hold
+    back the following answers.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # keep some time for the reverse DNS of the last hosts which answered
+    probe_timeout = timeout * (1 - DNS_TIMEOUT_SHARE)
+    resolver = aiodns.DNSResolver()
+    detectors = asyncio.Queue()
+    lookups = []
+
+    async def resolve(addr, version):
+        host = await get_host(addr, resolver, timeout=deadline - loop.time())
+        await detectors.put(Detector(host, port, version, addr))
+
+    async def probe():
+        try:
+            hosts = open_hosts(port, probe_timeout, addresses)
+            versions = iter_versions(hosts, port, probe_timeout, **kwargs)
+            async for addr, version in versions:
+                lookups.append(asyncio.create_task(resolve(addr, version)))
+            await asyncio.gather(*lookups)
+        finally:
+            detectors.put_nowait(None)
+
+    prober = asyncio.create_task(probe())
+    try:
+        while True:
+            detector = await detectors.get()
+            if detector is None:
+                await prober  # raises the probe error, if any
+                break
+            yield detector
+    finally:
+        for task in lookups + [prober]:
+            task.cancel()
+
+
+def detector_to_dict(detector):
+    host = detector.host
+    return dict(
+        name=host.name, aliases=list(host.aliases), addresses=list(host.addresses),
+        port=detector.port, version=detector.version, address=detector.address
+    )
+
+
+def detector_from_dict(data, version=None):
+    host = Host(data["name"], data["aliases"], data["addresses"])
+    version = data["version"] if version is None else version
+    return Detector(host, data["port"], version, data["address"])
+
+
+def refresh_in_background(port, timeout):
+    """launch a full sweep (which updates the cache) in a detached process"""
+    args = [
+        sys.executable, "-m", "limatb", "eiger", "scan", "--refresh",
+        "--port", str(port), "--timeout", str(timeout),
+    ]
+    subprocess.Popen(
+        args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+
+
+async def iter_cached_detectors(
+    port=DEFAULT_HTTP_PORT, timeout=2.0, cache_ttl=DEFAULT_TTL, refresh=False
+):
+    """
+    Yield detectors from the discovery cache, checked again (only their
+    API version is queried). A full sweep is done if the cache is empty or
+    if refresh is requested. If the cache is older than cache_ttl, the
+    cached detectors are used and a full sweep runs in the background.
+    The cache is updated even if the iteration stops early (the cached
+    detectors which were not checked yet are kept) but not if it fails.
+    """
+    cache = Cache("detectors")
+    key = f"Eiger:{port}"
+    timestamp, cached = cache.entry(key)
+    cached = {item["address"]: item for item in cached or ()}
+    sweep = refresh or not cached
+    detectors, complete, stopped = {}, False, False
     try:
-        for task in asyncio.as_completed(coros, timeout=timeout):
-            detector = await task
-            if detector is not None:
-                detectors.append(detector)
-    except asyncio.TimeoutError:
-        pass
-    return detectors
+        if sweep:
+            async for detector in iter_detectors(port, timeout):
+                detectors[detector.address] = detector_to_dict(detector)
+                yield detector
+        else:
+            async for addr, version in iter_versions(list(cached), port, timeout):
+                detector = detector_from_dict(cached[addr], version)
+                detectors[addr] = detector_to_dict(detector)
+                yield detector
+        complete = True
+    except GeneratorExit:
+        stopped = True
+        raise
+    finally:
+        if complete or stopped:
+            if sweep and complete:
+                timestamp = time.time()
+            elif stopped:
+                detectors = dict(cached, **detectors)
+            # a sweep stopped early counts as old (refreshed by the next scan)
+            timestamp = timestamp or 0
+            cache.set(key, list(detectors.values()), timestamp)
+            # never from a sweep: a failing refresh would spawn the next one
+            if not sweep and time.time() - timestamp > cache_ttl:
+                refresh_in_background(port, timeout)
+
+
+async def find_cached_detectors(
+    port=DEFAULT_HTTP_PORT, timeout=2.0, cache_ttl=DEFAULT_TTL, refresh=False
+):
+    return [
+        detector
+        async for detector in iter_cached_detectors(port, timeout, cache_ttl, refresh)
+    ]
 
 
 def detector_table(detectors):
@@ -66,27 +245,271 @@ def detector_table(detectors):
     table = beautifultable.BeautifulTable()
     table.columns.header = 'Host', 'Alias(es)', 'Address(es)', 'Port', 'API'
     for detector in detectors:
-        host, port, version = detector
+        host = detector.host
         aliases = '\n'.join(host.aliases)
         addresses = '\n'.join(host.addresses)
-        table.rows.append((host.name, aliases, addresses, port, version))
+        table.rows.append(
+            (host.name, aliases, addresses, detector.port, detector.version)
+        )
     return table
 
 
-async def scan(port=DEFAULT_HTTP_PORT, timeout=2):
-    detectors = await find_detectors(port, timeout)
+async def scan(port=DEFAULT_HTTP_PORT, timeout=2, cache_ttl=DEFAULT_TTL, refresh=False):
+    detectors = await find_cached_detectors(port, timeout, cache_ttl, refresh)
     return detector_table(detectors)
 
 
+async def scan_stream(
+    port=DEFAULT_HTTP_PORT, timeout=2, cache_ttl=DEFAULT_TTL, refresh=False
+):
+    """yield a one row table for each detector as soon as it is found"""
+    detectors = iter_cached_detectors(port, timeout, cache_ttl, refresh)
+    async for detector in detectors:
+        yield detector_table([detector])
+
+
 @eiger.command("scan")
 @click.option('-p', '--port', default=DEFAULT_HTTP_PORT)
 @click.option('--timeout', default=2.0)
+@cache_ttl
+@refresh
 @table_style
 @max_width
-def eiger_scan(port, timeout, table_style, max_width):
+def eiger_scan(port, timeout, cache_ttl, refresh, table_style, max_width):
     """show accessible eiger detectors on the network"""
-    table = asyncio.run(scan(port, timeout))
+    table = asyncio.run(scan(port, timeout, cache_ttl, refresh))
     style = getattr(table, "STYLE_" + table_style.upper())
     table.set_style(style)
     table.maxwidth = max_width
     click.echo(table)
+
+
+def host_url(host):
+    """base URL (http://<host>:<port>) of an eiger given as host[:port] or URL"""
+    if not host.startswith("http://"):
+        host = "http://" + host
+    url = urllib.parse.urlparse(host)
+    port = DEFAULT_HTTP_PORT if url.port is None else url.port
+    return f"http://{url.hostname}:{port}"
+
+
+def error_text(error):
+    return f"{type(error).__name__}: {error}"
+
+
+async def get_json(session, url):
+    async with session.get(url) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+
+async def fetch_section(session, base, version, section, skip=ARRAY_KEYS):
+    """({key: value}, {key: error}) of all the keys of a SIMPLON section"""
+    subsystem, kind = section.split("/")
+    url = f"{base}/{subsystem}/api/{version}/{kind}/"
+    keys = [key for key in await get_json(session, url + "keys") if key not in skip]
+    answers = await asyncio.gather(
+        *(get_json(session, url + key) for key in keys), return_exceptions=True
+    )
+    values, errors = {}, {}
+    for key, answer in zip(keys, answers):
+        if isinstance(answer, Exception):
+            errors[f"{section}/{key}"] = error_text(answer)
+        else:
+            values[key] = answer.get("value") if isinstance(answer, dict) else answer
+    return values, errors
+
+
+async def fetch_config(session, host, sections=CONFIG_SECTIONS, skip=ARRAY_KEYS):
+    """snapshot of one detector: {version, <section>: {key: value}, errors}"""
+    base = host_url(host)
+    version = (await get_json(session, f"{base}/detector/api/version/"))["value"]
+    answers = await asyncio.gather(
+        *(fetch_section(session, base, version, section, skip) for section in sections),
+        return_exceptions=True
+    )
+    snapshot = dict(version=version, errors={})
+    for section, answer in zip(sections, answers):
+        if isinstance(answer, Exception):
+            snapshot["errors"][section] = error_text(answer)
+        else:
+            snapshot[section], errors = answer
+            snapshot["errors"].update(errors)
+    return snapshot
+
+
+async def dump_config(
+    hosts, sections=CONFIG_SECTIONS, skip=ARRAY_KEYS,
+    concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_CONFIG_TIMEOUT
+):
+    """
+    snapshot of several detectors. All keys of all detectors are fetched
+    concurrently over one pooled session
+    """
+    async with http_session(concurrency, timeout) as session:
+        answers = await asyncio.gather(
+            *(fetch_config(session, host, sections, skip) for host in hosts),
+            return_exceptions=True
+        )
+    detectors = {}
+    for host, answer in zip(hosts, answers):
+        if isinstance(answer, Exception):
+            answer = dict(error=error_text(answer))
+        detectors[host] = answer
+    return dict(timestamp=time.time(), detectors=detectors)
+
+
+def diff_config(reference, current, sections=DIFF_SECTIONS):
+    """
+    [(section, key, reference value, current value)] (None: missing key).
+    Sections missing on either side (fetch error) are not compared
+    """
+    result = []
+    for section in sections:
+        if section not in reference or section not in current:
+            continue
+        ref, cur = reference[section], current[section]
+        for key in sorted(set(ref) | set(cur)):
+            if ref.get(key) != cur.get(key):
+                result.append((section, key, ref.get(key), cur.get(key)))
+    return result
+
+
+def diff_snapshots(reference, current, sections=DIFF_SECTIONS):
+    """
+    {host: differences} of each detector of current against the reference
+    detector with the same name (or the single reference detector).
+    Detectors which could not be fetched, here or in the reference, are
+    left out of the result
+    """
+    references = reference["detectors"]
+    result = {}
+    for host, snapshot in current["detectors"].items():
+        if host in references:
+            ref = references[host]
+        elif len(references) == 1:
+            ref = next(iter(references.values()))
+        else:
+            result[host] = [("", "", "not in reference", None)]
+            continue
+        if "error" in ref or "error" in snapshot:
+            continue
+        result[host] = diff_config(ref, snapshot, sections)
+    return result
+
+
+def snapshot_errors(snapshot):
+    """[(host, error)] of the snapshot (detector or key fetch errors)"""
+    errors = []
+    for host, detector in snapshot["detectors"].items():
+        if "error" in detector:
+            errors.append((host, detector["error"]))
+        for key, error in detector.get("errors", {}).items():
+            errors.append((host, f"{key}: {error}"))
+    return errors
+
+
+def diff_table(differences):
+    import beautifultable
+    table = beautifultable.BeautifulTable()
+    table.columns.header = "Host", "Key", "Reference", "Current"
+    for host, diffs in differences.items():
+        for section, key, ref, cur in diffs:
+            name = f"{section}/{key}" if section else key
+            table.rows.append((host, name, ref, cur))
+    return table
+
+
+def config_hosts(ctx, hosts):
+    """hosts given as arguments or the eiger --url"""
+    if hosts:
+        return list(hosts)
+    url = ctx.obj.get("camera_params", {}).get("url")
+    if url is None:
+        raise click.UsageError("give the detector host(s) or eiger --url", ctx)
+    return [url]
+
+
+def read_snapshot(filename):
+    with open(filename) as fobj:
+        return json.load(fobj)
+
+
+config_timeout = click.option(
+    "--timeout", type=float, default=DEFAULT_CONFIG_TIMEOUT, show_default=True,
+    help="HTTP request timeout (s)"
+)
+
+
+@eiger.group("config")
+def eiger_config():
+    """eiger configuration snapshots (SIMPLON API)"""
+
+
+@eiger_config.command("dump")
+@click.argument("hosts", nargs=-1)
+@click.option("-o", "--output", type=click.Path(dir_okay=False), default=None,
+              help="snapshot file (default: stdout)")
+@click.option("--with-arrays", is_flag=True, default=False,
+              help="include the big array values ({})".format(", ".join(ARRAY_KEYS)))
+@config_timeout
+@click.pass_context
+def eiger_config_dump(ctx, hosts, output, with_arrays, timeout):
+    """snapshot of the config, status and stream parameters of detectors"""
+    skip = () if with_arrays else ARRAY_KEYS
+    snapshot = asyncio.run(
+        dump_config(config_hosts(ctx, hosts), skip=skip, timeout=timeout)
+    )
+    text = json.dumps(snapshot, indent=1, default=str)
+    if output is None:
+        click.echo(text)
+    else:
+        with open(output, "w") as fobj:
+            fobj.write(text)
+    for host, error in snapshot_errors(snapshot):
+        click.echo(f"{host}: {error}", err=True)
+
+
+@eiger_config.command("diff")
+@click.argument("reference", type=click.Path(exists=True, dir_okay=False))
+@click.argument("hosts", nargs=-1)
+@click.option("-s", "--snapshot", type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help="compare this snapshot instead of the live detectors")
+@click.option("--status", is_flag=True, default=False,
+              help="compare also the (changing) status values")
+@config_timeout
+@table_style
+@max_width
+@click.pass_context
+def eiger_config_diff(
+    ctx, reference, hosts, snapshot, status, timeout, table_style, max_width
+):
+    """
+    compare detectors (default: the ones of the reference) with a reference
+    snapshot. Detectors which can't be fetched are reported and not
+    compared. Exit code is 1 if they differ, 2 if some couldn't be compared
+    """
+    reference = read_snapshot(reference)
+    if snapshot is not None:
+        current = read_snapshot(snapshot)
+    else:
+        if not hosts and ctx.obj.get("camera_params", {}).get("url") is None:
+            hosts = list(reference["detectors"])
+        hosts = config_hosts(ctx, hosts)
+        current = asyncio.run(dump_config(hosts, timeout=timeout))
+    sections = CONFIG_SECTIONS if status else DIFF_SECTIONS
+    for host, error in snapshot_errors(current):
+        click.echo(f"{host}: {error}", err=True)
+    differences = diff_snapshots(reference, current, sections)
+    skipped = [host for host in current["detectors"] if host not in differences]
+    for host in skipped:
+        click.echo(f"{host}: not compared (fetch error)", err=True)
+    if not any(differences.values()):
+        click.echo("No differences")
+        ctx.exit(2 if skipped else 0)
+    table = diff_table(differences)
+    table.set_style(getattr(table, "STYLE_" + table_style.upper()))
+    table.maxwidth = max_width
+    click.echo(table)
+    ctx.exit(1)
@@ -0,0 +1,58 @@
+import click
+import Lima.Core
+
+from limatb.cli import camera
+from limatb.util import camera_module
+
+PIXEL_DEPTHS = {"8": "Bpp8", "16": "Bpp16", "32": "Bpp32"}
+
+
+def frame_size(text):
+    try:
+        width, height = (int(i) for i in text.lower().split("x"))
+    except ValueError:
+        raise click.BadParameter(f"{text!r} (expected <width>x<height>)")
+    return width, height
+
+
+def set_default_frame_rate(ctx, param, frame_rate):
+    """make 1/frame_rate the default exposure time of acquire and bench"""
+    if not frame_rate:
+        return frame_rate
+    exposure_time = 1 / frame_rate
+    default_map = dict(ctx.default_map or {})
+    for name, value in (("acquire", exposure_time), ("bench", [exposure_time])):
+        defaults = dict(default_map.get(name) or {})
+        defaults.setdefault("exposure_time", value)
+        default_map[name] = defaults
+    ctx.default_map = default_map
+    return frame_rate
+
+
+@camera(name="simulator")
+@click.option("--frame-size", default="1024x1024", type=frame_size,
+              show_default=True, help="frame size (<width>x<height>)")
+@click.option("--pixel-depth", default="16", show_default=True,
+              type=click.Choice(PIXEL_DEPTHS), help="bits per pixel")
+@click.option("--fill-type", default="gauss", show_default=True,
+              type=click.Choice(["gauss", "diffraction"], case_sensitive=False))
+@click.option("--max-frame-rate", type=float, default=None,
+              callback=set_default_frame_rate, expose_value=False,
+              help="frame rate (Hz) used by default by acquire and bench "
+                   "(sets their default exposure time to 1/rate)")
+@click.option("--prefetch", type=int, default=0, show_default=True,
+              help="nb. of frames generated in advance (0: generate on the fly)")
+def simulator(frame_size, pixel_depth, fill_type, prefetch):
+    """simulator camera specific commands"""
+    Simulator = camera_module("Simulator")
+    camera = Simulator.Camera()
+    if prefetch:
+        # precomputed frames: frame generation cost is kept out of benchmarks
+        camera.setMode(Simulator.Camera.MODE_GENERATOR_PREFETCH)
+        camera.getFrameGetter().setNbPrefetchedFrames(prefetch)
+    image_type = getattr(Lima.Core, PIXEL_DEPTHS[pixel_depth])
+    frame_dim = Lima.Core.FrameDim(Lima.Core.Size(*frame_size), image_type)
+    camera.setFrameDim(frame_dim)
+    fill_type = getattr(Simulator.FrameBuilder, fill_type.capitalize())
+    camera.getFrameGetter().setFillType(fill_type)
+    return Simulator.Interface(camera)
@@ -7,18 +7,45 @@
 
 __all__ = ['main']
 
-import asyncio
+import shutil
 import logging
 import functools
+import importlib
+
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:
+    import importlib_metadata
 
 import click
 
-from .util import scan
+from .cache import DEFAULT_TTL
 
 
 log = logging.getLogger("limatb")
 
 
+CAMERA_ENTRY_POINT = 'limatb.cli.camera'
+SCAN_ENTRY_POINT = 'limatb.cli.camera.scan'
+
+
+# sub-commands common to all cameras: name: (import path, short help)
+CAMERA_COMMANDS = {
+    'info': ('limatb.info:info', 'Shows information about the camera'),
+    'acquire': ('limatb.acquire:acquire', 'Executes an acquisition'),
+    'bench': ('limatb.bench:bench', 'Benchmarks a matrix of short acquisitions'),
+}
+
+
+# top level sub-commands which are not camera specific
+COMMANDS = {
+    'multi-acquire': (
+        'limatb.multi:multi_acquire',
+        'Executes a synchronized acquisition on several detectors'
+    ),
+}
+
+
 url = click.option("-u", "--url", type=str)
 
 
@@ -31,11 +58,129 @@ table_style = click.option(
 max_width = click.option(
     "--max-width",
     type=int,
-    default=lambda: click.get_terminal_size()[0],
+    default=lambda: shutil.get_terminal_size()[0],
     help="maximum width",
 )
 
 
+cache_ttl = click.option(
+    "--cache-ttl", type=float, default=DEFAULT_TTL, show_default=True,
+    help="discovery cache time to live (s)"
+)
+
+
+refresh = click.option(
+    "--refresh", is_flag=True, default=False,
+    help="ignore discovery cache and do a full network sweep"
+)
+
+
+def iter_entry_points(group):
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return entry_points.select(group=group)
+    return entry_points.get(group, ())
+
+
+def import_object(path):
+    module_name, name = path.split(':')
+    return getattr(importlib.import_module(module_name), name)
+
+
+class LazyGroup(click.Group):
+    """
+    Click group which only imports a sub-command when it is invoked.
+
+    Sub-commands come from *lazy_commands* (name: (import path, short
+    help)) and from the *entry_point* group (command name is the entry
+    point name in lower case). Help lists them without importing them: a
+    camera plugin which fails to import reports its error when invoked.
+    """
+
+    def __init__(self, *args, lazy_commands=None, entry_point=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = dict(lazy_commands or {})
+        self.entry_point = entry_point
+
+    def entry_points(self):
+        if self.entry_point is None:
+            return {}
+        return {ep.name.lower(): ep for ep in iter_entry_points(self.entry_point)}
+
+    def list_commands(self, ctx):
+        names = set(self.commands) | set(self.lazy_commands)
+        return sorted(names | set(self.entry_points()))
+
+    def load_command(self, name):
+        if name in self.lazy_commands:
+            return import_object(self.lazy_commands[name][0])
+        entry_point = self.entry_points().get(name)
+        if entry_point is None:
+            return
+        try:
+            return entry_point.load()
+        except Exception as error:
+            log.debug('failed to load camera %s', entry_point.name, exc_info=True)
+            raise click.ClickException(
+                'cannot load {} commands: {!r}'.format(entry_point.name, error)
+            )
+
+    def get_command(self, ctx, name):
+        command = self.commands.get(name)
+        if command is None:
+            command = self.load_command(name)
+            if command is not None:
+                self.add_command(command, name)
+        return command
+
+    def command_help(self, name, limit):
+        if name in self.commands:
+            command = self.commands[name]
+            return None if command.hidden else command.get_short_help_str(limit)
+        if name in self.lazy_commands:
+            return self.lazy_commands[name][1]
+        return '{} camera commands'.format(self.entry_points()[name].name)
+
+    def format_commands(self, ctx, formatter):
+        names = self.list_commands(ctx)
+        if not names:
+            return
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            help = self.command_help(name, limit)
+            if help is not None:
+                rows.append((name, help))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+class CameraObject(dict):
+    """
+    Context object of the camera sub-commands. The camera interface
+    ('interface' key) is only created when a sub-command first uses it so
+    commands which can answer without the detector (ex: from a cache) don't
+    pay for its initialization.
+    """
+
+    def __init__(self, factory, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.factory = factory
+
+    def __missing__(self, key):
+        if key != 'interface':
+            raise KeyError(key)
+        self[key] = interface = self.factory()
+        return interface
+
+
+def camera_key(obj):
+    """detector identity from a camera context object: camera name and options"""
+    params = sorted(obj.get('camera_params', {}).items())
+    return '{}:{}'.format(obj.get('camera'), ','.join(f'{k}={v}' for k, v in params))
+
+
 def camera(func=None, **attrs):
     """Helper click group command decorator"""
     if func is None:
@@ -43,20 +188,19 @@ def camera(func=None, **attrs):
 
     @functools.wraps(func)
     def decorator(ctx, *args, **kwargs):
-        ctx.obj['interface'] = func(*args, **kwargs)
-
-    group = click.group(**attrs)(click.pass_context(decorator))
-
-    from .info import info
-    from .acquire import acquire
-
-    group.add_command(info)
-    group.add_command(acquire)
+        ctx.obj = CameraObject(
+            functools.partial(func, *args, **kwargs), ctx.obj or {},
+            camera=ctx.info_name, camera_params=dict(ctx.params),
+        )
 
-    return group
+    attrs.setdefault('cls', LazyGroup)
+    attrs.setdefault('lazy_commands', CAMERA_COMMANDS)
+    return click.group(**attrs)(click.pass_context(decorator))
 
 
-@click.group('limatb')
+@click.group(
+    'limatb', cls=LazyGroup, lazy_commands=COMMANDS, entry_point=CAMERA_ENTRY_POINT
+)
 @click.pass_context
 def cli(ctx):
     """
@@ -68,47 +212,80 @@ def cli(ctx):
     ctx.ensure_object(dict)
 
 
+def camera_scans():
+    """Scan functions of the cameras who registered one with an entry point"""
+    scans = []
+    for ep in iter_entry_points(SCAN_ENTRY_POINT):
+        try:
+            scans.append((ep.name, ep.load()))
+        except Exception as error:
+            log.debug('failed to register scan %s: %r', ep.name, error)
+    return scans
+
+
+def continuation_table(table, reference, style):
+    """
+    Header less table with the same layout as an already printed table
+    (used to append rows to it)
+    """
+    import beautifultable
+    result = beautifultable.BeautifulTable(maxwidth=reference.maxwidth)
+    for row in table.rows:
+        result.rows.append(list(row))
+    result.set_style(style)
+    result.columns.width = list(reference.columns.width)
+    result.columns.alignment = reference.columns.alignment
+    return result
+
+
 @cli.command("scan")
 @click.option('--timeout', default=2.0)
+@click.option('--expect', type=int, default=0,
+              help='stop as soon as this number of detectors is found')
+@cache_ttl
+@refresh
 @table_style
 @max_width
-def lima_scan(timeout, table_style, max_width):
+def lima_scan(timeout, expect, cache_ttl, refresh, table_style, max_width):
     """scan network for detectors"""
-    tables, errors = asyncio.run(scan(cli.scans, timeout))
-    for name, table in tables:
-        if len(table.rows):
-            style = getattr(table, "STYLE_" + table_style.upper())
-            table.set_style(style)
-            table.maxwidth = max_width
-            click.echo(name+":")
-            click.echo(table)
-            click.echo()
-    for error in errors:
-        click.echo('error: {!r}'.format(error), err=True)
-
-
-def register_lima_camera_commands(group):
-    """
-    Return commands for those cameras who registered themselves
-    with an entry point
-    """
-    import pkg_resources
-    for ep in pkg_resources.iter_entry_points('limatb.cli.camera'):
-        try:
-            group.add_command(ep.load())
-        except Exception as error:
-            log.debug('failed to register camera %s: %r', ep.name, error)
+    import asyncio
+    from .discovery import scan_stream
 
-    group.scans = []
-    for ep in pkg_resources.iter_entry_points('limatb.cli.camera.scan'):
+    async def run():
+        printed, found, last = {}, 0, None
+        results = scan_stream(
+            camera_scans(), timeout, cache_ttl=cache_ttl, refresh=refresh
+        )
         try:
-            group.scans.append((ep.name, ep.load()))
-        except Exception as error:
-            log.debug('failed to register scan %s: %r', ep.name, error)
+            async for name, table, error in results:
+                if error is not None:
+                    click.echo('error: {!r}'.format(error), err=True)
+                    continue
+                if not len(table.rows):
+                    continue
+                style = getattr(table, "STYLE_" + table_style.upper())
+                if name in printed:
+                    table = continuation_table(table, printed[name], style)
+                else:
+                    table.set_style(style)
+                    table.maxwidth = max_width
+                    printed[name] = table
+                if name != last:
+                    if last is not None:
+                        click.echo()
+                    click.echo(name+":")
+                    last = name
+                click.echo(table)
+                found += len(table.rows)
+                if expect and found >= expect:
+                    break
+        finally:
+            await results.aclose()
+
+    asyncio.run(run())
 
 
 def main():
-    register_lima_camera_commands(cli)
     cli()
 
 
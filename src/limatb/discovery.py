@@ -0,0 +1,85 @@
+"""
+Detector discovery: runs the scan of every camera plugin.
+
+Network plugins share one TCP connect sweep (network.open_hosts) so the
+subnet is swept once per port, whatever the number of plugins, and each
+plugin only runs its protocol check on the hosts with an open port.
+"""
+
+import asyncio
+import inspect
+import functools
+
+from .network import Sweep, current_sweep
+from .util import call_in_daemon_thread
+
+
+def supported_kwargs(func, kwargs):
+    """subset of kwargs which func accepts"""
+    parameters = inspect.signature(func).parameters
+    if any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+        return dict(kwargs)
+    return {key: value for key, value in kwargs.items() if key in parameters}
+
+
+async def scan_stream(scans, timeout, **kwargs):
+    """
+    Run all scans concurrently and yield (name, table, error) as soon as
+    results are available.
+
+    A scan can be a function, a coroutine function or an async generator
+    function. The latter yields tables with the detectors found so far
+    (typically one row each) so they can be reported right away. Extra
+    keyword arguments (ex: cache_ttl, refresh) are only given to the scan
+    functions which accept them. Scans still running after timeout are
+    reported with an asyncio.TimeoutError.
+    """
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    done = object()
+    sweep = Sweep()
+
+    async def detector_scan(scan, name):
+        # each task runs in a copy of the context: doesn't leak to the caller
+        current_sweep.set(sweep)
+        scan = functools.partial(
+            scan, timeout=timeout, **supported_kwargs(scan, kwargs)
+        )
+        try:
+            if inspect.isasyncgenfunction(scan.func):
+                async for table in scan():
+                    await results.put((name, table, None))
+            elif asyncio.iscoroutinefunction(scan.func):
+                await results.put((name, await scan(), None))
+            else:
+                result = await asyncio.wrap_future(call_in_daemon_thread(scan))
+                await results.put((name, result, None))
+        except Exception as error:
+            await results.put((name, None, error))
+        finally:
+            await results.put((name, done, None))
+
+    running = set()
+    tasks = []
+    for name, scan in scans:
+        running.add(name)
+        tasks.append(asyncio.create_task(detector_scan(scan, name)))
+
+    deadline = loop.time() + timeout + 0.1
+    try:
+        while running:
+            try:
+                result = await asyncio.wait_for(results.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if result[1] is done:
+                running.discard(result[0])
+            else:
+                yield result
+        for name in sorted(running):
+            yield name, None, asyncio.TimeoutError(f"{name} scan timed out")
+    finally:
+        for task in tasks:
+            task.cancel()
+        sweep.close()
+
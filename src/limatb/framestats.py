@@ -0,0 +1,118 @@
+"""
+Live statistics of the acquired frames.
+
+A worker thread reads the last ready frame from the Lima buffer (no file
+access: saving is not slowed down) at a capped rate and computes its
+statistics with NumPy. The monitor loop only reads the latest result so
+it is never blocked by the computation.
+"""
+
+import threading
+import collections
+
+import numpy
+
+FrameStatistics = collections.namedtuple(
+    "FrameStatistics", "frame min max mean saturated histogram"
+)
+
+SPARK = "▁▂▃▄▅▆▇█"
+
+
+def saturation_level(dtype):
+    """maximum value of an integer pixel type (None for floats)"""
+    dtype = numpy.dtype(dtype)
+    return numpy.iinfo(dtype).max if dtype.kind in "iu" else None
+
+
+def frame_statistics(frame, data, saturation=None, bins=8):
+    """statistics of a frame (histogram of bins between 0 and saturation)"""
+    data = numpy.asarray(data)
+    if saturation is None:
+        saturation = saturation_level(data.dtype)
+    if saturation is None:
+        saturated = 0
+        value_range = None
+    else:
+        saturated = int(numpy.count_nonzero(data >= saturation))
+        value_range = (0, saturation)
+    histogram, _ = numpy.histogram(data, bins=bins, range=value_range)
+    return FrameStatistics(
+        frame, data.min().item(), data.max().item(), float(data.mean()),
+        saturated, histogram
+    )
+
+
+def sparkline(histogram):
+    """histogram as a line of block characters (log scale)"""
+    levels = numpy.log1p(histogram)
+    top = levels.max()
+    if top <= 0:
+        return SPARK[0] * len(histogram)
+    indexes = numpy.round(levels / top * (len(SPARK) - 1)).astype(int)
+    return "".join(SPARK[i] for i in indexes)
+
+
+def statistics_text(stats):
+    if stats is None:
+        return "waiting for frames"
+    text = (
+        f"#{stats.frame} min {stats.min} | max {stats.max} | "
+        f"mean {stats.mean:.1f} | sat. {stats.saturated} | {sparkline(stats.histogram)}"
+    )
+    if stats.saturated:
+        text += " SATURATED"
+    elif stats.min == stats.max:
+        text += " BLANK"
+    return text
+
+
+class FrameStatisticsMonitor:
+    """
+    Computes the statistics of the last ready frame at most *rate* times
+    per second in a worker thread. Frames are only read when a new one is
+    ready. Use as a context manager around the acquisition monitor.
+    """
+
+    def __init__(self, ctrl, rate=2.0, saturation=None, bins=8):
+        self.ctrl = ctrl
+        self.period = 1 / rate
+        self.saturation = saturation
+        self.bins = bins
+        self.stats = None
+        self._last = -1
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self.run, name="FrameStatistics", daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        # last frame, so the final statistics are up to date
+        self.sample()
+
+    def sample(self):
+        last = self.ctrl.getStatus().ImageCounters.LastImageReady
+        if last < 0 or last == self._last:
+            return
+        try:
+            data = self.ctrl.ReadImage(last)
+            self.stats = frame_statistics(
+                last, data.buffer, self.saturation, self.bins
+            )
+        except Exception:
+            # frame may have been overwritten in the buffer: try next time
+            return
+        self._last = last
+
+    def run(self):
+        while not self._stop.wait(self.period):
+            self.sample()
+
+    def label(self):
+        return "Frame " + statistics_text(self.stats)
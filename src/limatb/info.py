@@ -1,21 +1,53 @@
+import json
+import time
+import concurrent.futures
+
 import click
 import Lima.Core
 
+from .cli import camera_key
+from .cache import Cache
+from .util import call_in_daemon_thread
 
-def info_list(info):
+# maximum time (s) to wait for each DetInfo getter
+DEFAULT_TIMEOUT = 5.0
+
+
+def getters(info):
     result = []
     for name in dir(info):
         if not name.startswith('get'):
             continue
         member = getattr(info, name)
         if callable(member):
-            try:
-                result.append((name[3:], member()))
-            except Exception:
-                pass
+            result.append((name[3:], member))
     return result
 
 
+def fetch_info(info, timeout=DEFAULT_TIMEOUT):
+    """
+    Call all the DetInfo getters concurrently (for some detectors each one
+    is a network round trip). Returns ([(name, value)], [(name, error)]).
+    Getters not answering within timeout seconds fail with a TimeoutError.
+    """
+    futures = [(name, call_in_daemon_thread(getter)) for name, getter in getters(info)]
+    deadline = time.monotonic() + timeout
+    values, errors = [], []
+    for name, future in futures:
+        try:
+            values.append((name, future.result(max(0, deadline - time.monotonic()))))
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            errors.append((name, TimeoutError(f'no answer within {timeout} s')))
+        except Exception as error:
+            errors.append((name, error))
+    return values, errors
+
+
+def info_list(info):
+    return fetch_info(info)[0]
+
+
 def info_text(info):
     dinfo = info if isinstance(info, (list, tuple)) else info_list(info)
     size = max(len(i[0]) for i in dinfo)
@@ -24,10 +56,70 @@ def info_text(info):
     return '\n'.join(lines)
 
 
+def plain(value):
+    """JSON/YAML friendly version of a getter value"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return str(value)
+
+
+def read_info(obj, timeout=DEFAULT_TIMEOUT, cache_ttl=0):
+    """
+    {'info': {name: value}, 'errors': {name: error}, 'timestamp': t} read
+    from the detector or from the cache if younger than cache_ttl seconds.
+    Fresh results are always stored in the cache
+    """
+    cache, key = Cache('info'), camera_key(obj)
+    if cache_ttl > 0:
+        data = cache.get(key, cache_ttl)
+        if data is not None:
+            return data
+    interface = obj['interface']
+    if interface is None:
+        raise click.UsageError('missing detector')
+    info = interface.getHwCtrlObj(Lima.Core.HwCap.DetInfo)
+    values, errors = fetch_info(info, timeout)
+    data = dict(
+        info={name: plain(value) for name, value in values},
+        errors={name: repr(error) for name, error in errors},
+        timestamp=time.time(),
+    )
+    cache.set(key, data, data['timestamp'])
+    return data
+
+
+def yaml_dump(data):
+    try:
+        import yaml
+    except ImportError:
+        raise click.ClickException(
+            'YAML output needs PyYAML (pip install lima-toolbox[yaml])'
+        )
+    return yaml.safe_dump(data, sort_keys=False)
+
+
 @click.command("info")
+@click.option('--format', 'fmt', default='text', show_default=True,
+              type=click.Choice(['text', 'json', 'yaml'], case_sensitive=False),
+              help='output format')
+@click.option('--timeout', type=float, default=DEFAULT_TIMEOUT, show_default=True,
+              help='maximum time (s) to wait for each information')
+@click.option('--cache-ttl', type=float, default=0, show_default=True,
+              help='reuse information read less than this time (s) ago '
+                   '(0: always read the detector)')
 @click.pass_context
-def info(ctx):
+def info(ctx, fmt, timeout, cache_ttl):
     """Shows information about the camera"""
-    interface = ctx.obj['interface']
-    info = interface.getHwCtrlObj(Lima.Core.HwCap.DetInfo)
-    click.echo(info_text(info))
+    data = read_info(ctx.obj, timeout, cache_ttl)
+    fmt = fmt.lower()
+    if fmt == 'json':
+        click.echo(json.dumps(data, indent=2))
+    elif fmt == 'yaml':
+        click.echo(yaml_dump(data), nl=False)
+    else:
+        if data['info']:
+            click.echo(info_text(list(data['info'].items())))
+        for name, error in data['errors'].items():
+            click.echo(f'{name}: {error}', err=True)
@@ -0,0 +1,211 @@
+"""
+Concurrent acquisition on several detectors in one process.
+
+Each detector is given as a camera spec: the camera command followed by
+its options, as on the command line (ex: "eiger --url=dcu-1"). Detectors
+are prepared in parallel and started together from threads released by
+a barrier so their start skew is kept to a minimum.
+"""
+
+import os
+import time
+import shlex
+import signal
+import threading
+import contextlib
+import concurrent.futures
+
+import click
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit import HTML
+from prompt_toolkit.shortcuts import ProgressBar
+
+import Lima.Core
+
+from .acquire import (
+    acquire, configure, cleanup, ReportTask, Options, AcquisitionContext,
+    AcquisitionMonitor,
+)
+
+# acquire options which also make sense for several detectors
+ACQUIRE_OPTIONS = (
+    'nb_frames', 'exposure_time', 'latency_time', 'trigger',
+    'saving_directory', 'saving_format', 'saving_policy', 'saving_managed_mode',
+    'saving_nb_frames_per_file', 'saving_mode', 'saving_prefix', 'saving_suffix',
+    'saving_statistics_history_size', 'frame_type', 'max_buffer_size',
+    'nb_saving_tasks', 'nb_processing_tasks',
+    'cleanup', 'cleanup_tasks', 'cleanup_background', 'refresh_rate',
+)
+
+
+def camera_context(ctx, spec):
+    """
+    (name, click context) of the camera group described by spec. The
+    camera callback (which creates the interface) is not invoked yet
+    """
+    args = shlex.split(spec)
+    if not args:
+        raise click.BadParameter('empty camera spec', param_hint='--camera')
+    name, args = args[0].lower(), args[1:]
+    root = ctx.find_root()
+    group = root.command.get_command(root, name)
+    if not isinstance(group, click.Group) or 'acquire' not in group.list_commands(root):
+        raise click.BadParameter(f'unknown camera {name!r}', param_hint='--camera')
+    # parsed as if acquire was invoked: a camera group called without
+    # sub-command would otherwise print its help and exit
+    cam_ctx = group.make_context(name, args + ['acquire'], parent=root, obj={})
+    return name, cam_ctx
+
+
+def create_interface(cam_ctx, spec):
+    with cam_ctx:
+        cam_ctx.invoke(cam_ctx.command.callback, **cam_ctx.params)
+    interface = cam_ctx.obj['interface']
+    if interface is None:
+        # the camera options which identify the detector are missing
+        raise click.BadParameter(f'missing detector in {spec!r}', param_hint='--camera')
+    return interface
+
+
+def detector_names(names):
+    """unique display names: camera name + index if it appears more than once"""
+    result = []
+    for index, name in enumerate(names):
+        if names.count(name) > 1:
+            name += str(names[:index].count(name))
+        result.append(name)
+    return result
+
+
+def fps_label(name, counter):
+    elapsed = counter.time_elapsed.total_seconds()
+    fps = counter.items_completed / elapsed if elapsed > 0 else 0.0
+    return f'{name} Acquired {fps:.1f} fps'
+
+
+class Detector:
+    """One of the detectors of a multi-detector acquisition"""
+
+    def __init__(self, name, spec, cam_ctx, options):
+        self.name = name
+        self.spec = spec
+        self.cam_ctx = cam_ctx
+        self.options = options
+        self.ctrl = None
+        self.acq_ctx = None
+        self.monitor = None
+        self.start_time = None
+
+    def initialize(self):
+        self.ctrl = Lima.Core.CtControl(create_interface(self.cam_ctx, self.spec))
+
+    def configure(self):
+        configure(self.ctrl, self.options)
+
+    def prepare(self):
+        self.acq_ctx.prepareAcq()
+
+    def start(self, barrier):
+        barrier.wait()
+        self.start_time = time.perf_counter()
+        self.acq_ctx.startAcq()
+
+    def create_monitor(self, prog_bar):
+        self.monitor = monitor = AcquisitionMonitor(
+            self.acq_ctx, prog_bar, self.options, name=self.name
+        )
+        counter = monitor.acq_counter
+        counter.label = lambda: fps_label(self.name, counter)
+        return monitor
+
+
+def run_all(executor, func, detectors):
+    """run func(detector) for all detectors in parallel; raise first error"""
+    for future in [executor.submit(func, detector) for detector in detectors]:
+        future.result()
+
+
+def monitor_all(detectors, period=0.05):
+    running = list(detectors)
+    while running:
+        running = [det for det in running if det.monitor.update(det.acq_ctx.status)]
+        time.sleep(period)
+    for det in detectors:
+        det.monitor.update(det.acq_ctx.status)
+        det.monitor.redraw(force=True)
+
+
+@click.command("multi-acquire")
+@click.option('-c', '--camera', 'cameras', multiple=True, required=True,
+              help='camera spec: "<camera> [camera options]" '
+                   '(repeat for each detector)')
+@click.pass_context
+def multi_acquire(ctx, cameras, **kwargs):
+    """
+    Executes a synchronized acquisition on several detectors
+
+    \b
+    Example:
+    $ limatb multi-acquire -c "eiger --url=dcu-1" -c "eiger --url=dcu-2" \\
+        -n 1000 -e 0.001
+    """
+    specs = [camera_context(ctx, spec) for spec in cameras]
+    names = detector_names([name for name, _ in specs])
+    detectors = []
+    for name, spec, (_, cam_ctx) in zip(names, cameras, specs):
+        options = dict(kwargs)
+        options['saving_prefix'] = f"{kwargs['saving_prefix']}{name}_"
+        detectors.append(Detector(name, spec, cam_ctx, Options(options)))
+
+    kb = KeyBindings()
+
+    @kb.add('x')
+    def _(event):
+        " Send Abort (control-c) signal. "
+        os.kill(os.getpid(), signal.SIGINT)
+
+    executor = concurrent.futures.ThreadPoolExecutor(len(detectors))
+    with executor, contextlib.ExitStack() as stack:
+        try:
+            with ReportTask(f'Initializing {len(detectors)} detectors'):
+                run_all(executor, Detector.initialize, detectors)
+            with ReportTask('Configuring'):
+                # processing thread pool is global: configure sequentially
+                for det in detectors:
+                    det.configure()
+            for det in detectors:
+                det.acq_ctx = stack.enter_context(AcquisitionContext(det.ctrl))
+            with ReportTask('Preparing'):
+                run_all(executor, Detector.prepare, detectors)
+            with ReportTask('Acquiring', end='\n'):
+                title = 'Acquiring on ' + ', '.join(names)
+                prog_bar = ProgressBar(
+                    title=title, bottom_toolbar=HTML(" <b>[x]</b> abort"),
+                    key_bindings=kb,
+                )
+                with prog_bar:
+                    for det in detectors:
+                        det.create_monitor(prog_bar)
+                    barrier = threading.Barrier(len(detectors))
+                    run_all(executor, lambda det: det.start(barrier), detectors)
+                    monitor_all(detectors)
+            start_times = [det.start_time for det in detectors]
+            skew = (max(start_times) - min(start_times)) * 1e3
+            click.echo(f'Start skew: {skew:.3f} ms')
+        except KeyboardInterrupt:
+            print("Ctrl-C pressed")
+        finally:
+            stack.close()
+            initialized = [det for det in detectors if det.ctrl is not None]
+            if kwargs['cleanup'] and kwargs['saving_directory'] and initialized:
+                with ReportTask('Cleaning up'):
+                    for det in initialized:
+                        cleanup(det.ctrl, det.options)
+            else:
+                with ReportTask('Cleaning up') as task:
+                    task.skip()
+
+
+multi_acquire.params.extend(
+    param for param in acquire.params if param.name in ACQUIRE_OPTIONS
+)
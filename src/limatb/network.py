@@ -1,57 +1,245 @@
+import math
 import asyncio
+import logging
+import ipaddress
+import contextvars
+import collections
 
 import aiodns
 import netifaces
 
+# networks larger than this are reduced to the /MIN_PREFIXLEN around the
+# interface address (avoids sweeping a /8 by accident)
+MIN_PREFIXLEN = 16
 
-def get_ipv4_addresses():
+DEFAULT_CONCURRENCY = 256
+DEFAULT_CONNECT_TIMEOUT = 0.5
+# shortest connect timeout a sweep is shortened to (LAN round trips are < 1 ms)
+MIN_CONNECT_TIMEOUT = 0.05
+# fraction of the time budget a sweep is sized to finish in
+SWEEP_BUDGET_SHARE = 0.9
+
+log = logging.getLogger("limatb.network")
+
+
+def get_ipv4_interfaces():
+    """Yield IPv4Interface (address + netmask) for every local address"""
     for interface in netifaces.interfaces():
         for addr in netifaces.ifaddresses(interface).get(netifaces.AF_INET, []):
-            yield addr['addr']
+            netmask = addr.get('netmask') or '255.255.255.0'
+            yield ipaddress.IPv4Interface(f"{addr['addr']}/{netmask}")
+
+
+def get_ipv4_addresses():
+    for interface in get_ipv4_interfaces():
+        yield str(interface.ip)
+
+
+def get_subnets(min_prefixlen=MIN_PREFIXLEN):
+    """Set of networks (non loopback) the local host is connected to"""
+    networks = set()
+    for interface in get_ipv4_interfaces():
+        if interface.ip.is_loopback:
+            continue
+        network = interface.network
+        if network.prefixlen < min_prefixlen:
+            network = ipaddress.IPv4Interface(f"{interface.ip}/{min_prefixlen}").network
+        networks.add(network)
+    return networks
 
 
-def get_subnet_addresses():
-    domains = (addr.rsplit('.', 1)[0] for addr in get_ipv4_addresses()
-               if not addr.startswith('127'))
+def get_subnet_addresses(min_prefixlen=MIN_PREFIXLEN):
     addresses = set()
-    for i in range(256):
-        for domain in domains:
-            addresses.add(f"{domain}.{i}")
-    for addr in get_ipv4_addresses():
-        if addr.startswith('127'):
-            addresses.add(addr)
-        else:
-            # assuming 255.255.255.0 netmask
-            domain = addr.rsplit('.', 1)[0]
-            for i in range(256):
-                addresses.add(f"{domain}.{i}")
+    for network in get_subnets(min_prefixlen):
+        addresses.update(str(addr) for addr in network.hosts())
+    for interface in get_ipv4_interfaces():
+        if interface.ip.is_loopback:
+            addresses.add(str(interface.ip))
     return addresses
 
 
-async def get_host_by_addr(addr):
-    return await aiodns.DNSResolver().gethostbyaddr(addr)
+Host = collections.namedtuple("Host", "name aliases addresses")
 
 
-async def test_connection(host, port):
+async def get_host_by_addr(addr, resolver=None):
+    if resolver is None:
+        resolver = aiodns.DNSResolver()
+    return await resolver.gethostbyaddr(addr)
+
+
+async def get_host(addr, resolver=None, timeout=None):
+    """
+    Reverse DNS lookup of addr. Returns Host(addr, [], [addr]) if the
+    address could not be resolved (in time)
+    """
+    try:
+        lookup = get_host_by_addr(addr, resolver)
+        return await asyncio.wait_for(lookup, timeout)
+    except (aiodns.error.DNSError, asyncio.TimeoutError):
+        return Host(addr, [], [addr])
+
+
+async def test_connection(host, port, timeout=None):
     try:
-        r, w = await asyncio.open_connection(host, port)
+        connection = asyncio.open_connection(host, port)
+        r, w = await asyncio.wait_for(connection, timeout)
         w.close()
         return host, True
-    except OSError:
+    except (OSError, asyncio.TimeoutError):
         return host, False
 
 
-async def get_hosts(port, timeout=None):
-    tasks = [asyncio.create_task(test_connection(addr, port))
-             for addr in get_subnet_addresses()]
-    for task in asyncio.as_completed(tasks, timeout=timeout):
-        host, is_open = await task
-        if is_open:
+def sweep_connect_timeout(
+    nb_addresses, concurrency, budget=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT
+):
+    """
+    connect timeout (at most connect_timeout) so a sweep of nb_addresses
+    silent addresses, concurrency at a time, finishes within budget seconds
+    (never below MIN_CONNECT_TIMEOUT)
+    """
+    if budget is None or nb_addresses <= 0:
+        return connect_timeout
+    rounds = math.ceil(nb_addresses / concurrency)
+    timeout = budget * SWEEP_BUDGET_SHARE / rounds
+    return max(MIN_CONNECT_TIMEOUT, min(connect_timeout, timeout))
+
+
+class PortSweep:
+    """
+    TCP connect sweep of one port. The open hosts are kept so every
+    consumer gets all of them, including the ones found before it started
+    """
+
+    def __init__(self, port, addresses, semaphore, connect_timeout):
+        self.port = port
+        self.nb_addresses = len(addresses)
+        self.nb_probed = 0
+        self.found = []
+        self.finished = False
+        self.warned = False
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self.run(addresses, semaphore, connect_timeout))
+
+    async def run(self, addresses, semaphore, connect_timeout):
+        async def probe(addr):
+            async with semaphore:
+                return await test_connection(addr, self.port, connect_timeout)
+
+        tasks = [asyncio.create_task(probe(addr)) for addr in addresses]
+        try:
+            for task in asyncio.as_completed(tasks):
+                host, is_open = await task
+                self.nb_probed += 1
+                if is_open:
+                    self.found.append(host)
+                    self.notify()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.finished = True
+            self.notify()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def hosts(self, timeout=None):
+        """yield the open hosts as soon as they are found (stops at timeout)"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        index = 0
+        while True:
+            while index < len(self.found):
+                yield self.found[index]
+                index += 1
+            if self.finished:
+                return
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                self.warn_incomplete(timeout)
+                return
+
+    def warn_incomplete(self, timeout):
+        if self.finished or self.warned:
+            return
+        self.warned = True
+        log.warning(
+            "port %d sweep incomplete: %d of %d addresses probed in %s s "
+            "(increase the timeout)", self.port, self.nb_probed,
+            self.nb_addresses, timeout
+        )
+
+
+class Sweep:
+    """
+    Phase one of the detector discovery: TCP connect sweeps shared by all
+    the camera plugins. Each (port, addresses) is swept once and the
+    connections of all the ports are bounded by the same *concurrency*.
+    Plugins then run their (slower) protocol check only on the open hosts.
+    The connect timeout is shortened (see sweep_connect_timeout) so a sweep
+    finishes within the timeout of the consumer which started it.
+    """
+
+    def __init__(
+        self, concurrency=DEFAULT_CONCURRENCY,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT
+    ):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.BoundedSemaphore(concurrency)
+        self.connect_timeout = connect_timeout
+        self.subnet_addresses = None
+        self.sweeps = {}
+
+    def sweep(self, port, addresses=None, timeout=None):
+        if addresses is None:
+            if self.subnet_addresses is None:
+                self.subnet_addresses = frozenset(get_subnet_addresses())
+            addresses = self.subnet_addresses
+        key = port, frozenset(addresses)
+        if key not in self.sweeps:
+            connect_timeout = sweep_connect_timeout(
+                len(key[1]), self.concurrency, timeout, self.connect_timeout
+            )
+            self.sweeps[key] = PortSweep(
+                port, key[1], self.semaphore, connect_timeout
+            )
+        return self.sweeps[key]
+
+    def open_hosts(self, port, timeout=None, addresses=None):
+        return self.sweep(port, addresses, timeout).hosts(timeout)
+
+    def close(self):
+        for sweep in self.sweeps.values():
+            sweep.task.cancel()
+
+
+# sweep shared by the plugin scans of a discovery (see discovery.scan_stream)
+current_sweep = contextvars.ContextVar("current_sweep", default=None)
+
+
+async def open_hosts(port, timeout=None, addresses=None):
+    """
+    Yield addresses which have the given TCP port open as soon as they are
+    found (stops at timeout). Uses the sweep shared by the running discovery
+    if any, otherwise a sweep of its own.
+    """
+    sweep = current_sweep.get()
+    if sweep is not None:
+        async for host in sweep.open_hosts(port, timeout, addresses):
+            yield host
+        return
+    sweep = Sweep()
+    try:
+        async for host in sweep.open_hosts(port, timeout, addresses):
             yield host
+    finally:
+        sweep.close()
 
 
 async def main(port, timeout=None):
-    async for host in get_hosts(port, timeout=timeout):
+    async for host in open_hosts(port, timeout):
         print(host)
 
 
@@ -0,0 +1,108 @@
+"""
+Acquisition planning: predicts buffer overflows (SaveOverun,
+ProcessingOverun) from the frame size, frame rate, Lima buffer size and
+the saving/processing speeds.
+
+Model: frames enter the buffer at the frame rate and leave it at the
+drain rate (the slowest of saving and processing). When the drain rate is
+lower, the backlog grows linearly until the buffer is full.
+"""
+
+import os
+import math
+import collections
+
+Overflow = collections.namedtuple("Overflow", "time frame stage")
+
+
+def total_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def buffer_frames(frame_size, max_buffer_size, memory=None):
+    """nb. of frames which fit in max_buffer_size % of the memory"""
+    memory = total_memory() if memory is None else memory
+    return int(memory * max_buffer_size / 100 // frame_size)
+
+
+def drain(saving_rate=None, processing_rate=None):
+    """(rate, stage) of the slowest stage (rates in frames/s, None: unlimited)"""
+    stages = [
+        (rate, stage)
+        for rate, stage in ((processing_rate, "processing"), (saving_rate, "saving"))
+        if rate is not None
+    ]
+    return min(stages) if stages else (None, None)
+
+
+def overflow(
+    nb_frames, frame_rate, nb_buffer_frames, saving_rate=None, processing_rate=None
+):
+    """
+    Overflow(time, frame, stage) at which the buffer overflows or None if
+    the acquisition of nb_frames (0: endless) fits
+    """
+    rate, stage = drain(saving_rate, processing_rate)
+    if rate is None or rate >= frame_rate:
+        return None
+    time = nb_buffer_frames / (frame_rate - rate)
+    frame = int(time * frame_rate)
+    if 0 < nb_frames <= frame:
+        return None
+    return Overflow(time, frame, stage)
+
+
+def required_buffer_frames(nb_frames, frame_rate, drain_rate):
+    """nb. of buffer frames needed to absorb the backlog (inf if endless)"""
+    if drain_rate is None or drain_rate >= frame_rate:
+        return 0
+    if nb_frames <= 0:
+        return math.inf
+    return math.ceil(nb_frames * (1 - drain_rate / frame_rate))
+
+
+def required_tasks(nb_tasks, frame_rate, rate):
+    """nb. of tasks to reach frame_rate assuming speed scales with tasks"""
+    return max(nb_tasks, math.ceil(nb_tasks * frame_rate / rate))
+
+
+def suggestions(
+    nb_frames, frame_rate, frame_size, nb_saving_tasks, nb_processing_tasks,
+    saving_rate=None, processing_rate=None, memory=None
+):
+    """list of (option, value, reason) which avoid the overflow"""
+    memory = total_memory() if memory is None else memory
+    result = []
+    rate, stage = drain(saving_rate, processing_rate)
+    if rate is None or rate >= frame_rate:
+        return result
+    frames = required_buffer_frames(nb_frames, frame_rate, rate)
+    size = 100 * frames * frame_size / memory
+    if size < 100:
+        result.append((
+            "--max-buffer-size", math.ceil(size * 10) / 10,
+            f"buffer {frames} frames to absorb the {stage} backlog"
+        ))
+    if saving_rate is not None and saving_rate < frame_rate:
+        result.append((
+            "--nb-saving-tasks",
+            required_tasks(nb_saving_tasks, frame_rate, saving_rate),
+            "if saving speed scales with the nb. of tasks"
+        ))
+    if processing_rate is not None and processing_rate < frame_rate:
+        result.append((
+            "--nb-processing-tasks",
+            required_tasks(nb_processing_tasks, frame_rate, processing_rate),
+            "if processing speed scales with the nb. of tasks"
+        ))
+    return result
+
+
+def frames_per_file(frame_rate, speeds):
+    """
+    smallest frames per file which sustains frame_rate given a dict of
+    {frames per file: saving rate (frames/s)} or None
+    """
+    for nb, rate in sorted(speeds.items()):
+        if rate >= frame_rate:
+            return nb
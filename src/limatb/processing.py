@@ -0,0 +1,116 @@
+"""
+Lima software processing stages (processlib tasks) installed through the
+CtControl external operations: ROI counters, binning, background
+subtraction and flat-field correction.
+
+Stages are installed in the order background, flat-field, binning, ROI
+counters, each at its own level so they run one after the other on each
+frame.
+"""
+
+import collections
+
+import click
+import numpy
+import Lima.Core
+
+from .verify import iter_edf_frames
+
+Stage = collections.namedtuple("Stage", "name op_type setup")
+
+EDF_DTYPES = {
+    "UnsignedByte": "u1", "SignedByte": "i1", "UnsignedShort": "u2",
+    "SignedShort": "i2", "UnsignedInteger": "u4", "SignedInteger": "i4",
+    "UnsignedLong": "u4", "SignedLong": "i4", "Unsigned64": "u8",
+    "Signed64": "i8", "FloatValue": "f4", "DoubleValue": "f8",
+}
+
+
+def roi(text):
+    """click type: <x>,<y>,<width>,<height>"""
+    try:
+        x, y, width, height = (int(i) for i in text.split(","))
+    except ValueError:
+        raise click.BadParameter(f"{text!r} (expected <x>,<y>,<width>,<height>)")
+    return x, y, width, height
+
+
+def binning(text):
+    """click type: <x>x<y>"""
+    try:
+        x, y = (int(i) for i in text.lower().split("x"))
+    except ValueError:
+        raise click.BadParameter(f"{text!r} (expected <x>x<y>)")
+    return x, y
+
+
+def read_edf_image(path):
+    """first frame of an EDF file as a numpy array"""
+    with open(path, "rb") as fobj:
+        buff = fobj.read()
+    header, offset, size = next(iter_edf_frames(buff))
+    order = ">" if header.get("ByteOrder") == "HighByteFirst" else "<"
+    dtype = numpy.dtype(order + EDF_DTYPES[header["DataType"]])
+    shape = int(header.get("Dim_2", 1)), int(header["Dim_1"])
+    return numpy.frombuffer(buff, dtype, size // dtype.itemsize, offset).reshape(shape)
+
+
+def load_image(path):
+    """Lima Data of an image file (EDF or numpy .npy)"""
+    if path.endswith(".npy"):
+        array = numpy.load(path)
+    else:
+        array = read_edf_image(path)
+    data = Lima.Core.Data()
+    data.buffer = numpy.ascontiguousarray(array)
+    return data
+
+
+def processing_stages(options):
+    """
+    stages requested by the acquire options (in installation order). The
+    setup functions bind their values (default arguments): the stage
+    variables are reused by the next stages
+    """
+    stages = []
+    if options.background:
+        image = load_image(options.background)
+        stages.append(Stage(
+            "background", Lima.Core.BACKGROUNDSUBSTRACTION,
+            lambda op, image=image: op.setBackgroundImage(image)
+        ))
+    if options.flatfield:
+        image = load_image(options.flatfield)
+        stages.append(Stage(
+            "flat-field", Lima.Core.FLATFIELDCORRECTION,
+            lambda op, image=image: op.setFlatFieldImage(image, True)
+        ))
+    if options.soft_binning:
+        x, y = options.soft_binning
+        stages.append(Stage(
+            f"binning {x}x{y}", Lima.Core.BIN,
+            lambda op, x=x, y=y: op.setBinning(x, y)
+        ))
+    if options.roi_counter:
+        rois = [
+            (f"roi{i}", Lima.Core.Roi(*roi))
+            for i, roi in enumerate(options.roi_counter)
+        ]
+        stages.append(Stage(
+            f"{len(rois)} ROI counter(s)", Lima.Core.ROICOUNTERS,
+            lambda op, rois=rois: op.updateRois(rois)
+        ))
+    return stages
+
+
+def stage_alias(index):
+    return f"limatb-stage-{index}"
+
+
+def install(ctrl, stages, start=0):
+    """install stages (numbered from start) on the control external operations"""
+    ext = ctrl.externalOperation()
+    for index, stage in enumerate(stages, start):
+        op = ext.addOp(stage.op_type, stage_alias(index), index)
+        stage.setup(op)
+
@@ -0,0 +1,112 @@
+"""
+Progress reporting without a terminal UI.
+
+The classes here have the interface of the prompt_toolkit ProgressBar used
+by the acquisition monitor (create counters by calling it, invalidate,
+context manager) so they can replace it when acquire runs without a TTY
+(ex: batch schedulers):
+
+* NullProgress: no output at all
+* JsonlProgress: one JSON record per period (counters, fps, acquisition
+  status and error) written from a background thread
+"""
+
+import sys
+import json
+import time
+import datetime
+import threading
+
+
+class Counter:
+    """Progress counter (the ProgressBarCounter attributes used by limatb)"""
+
+    def __init__(self, progress, label="", total=None):
+        self.progress = progress
+        self.label = label
+        self.total = total
+        self.items_completed = 0
+        self.start_time = datetime.datetime.now()
+
+    @property
+    def time_elapsed(self):
+        return datetime.datetime.now() - self.start_time
+
+    @property
+    def label_text(self):
+        return self.label() if callable(self.label) else self.label
+
+
+class NullProgress:
+
+    def __init__(self, title=None, **kwargs):
+        self.title = title
+        self.counters = []
+        self.status = None
+        self.error = None
+
+    def __call__(self, data=None, label="", total=None, **kwargs):
+        counter = Counter(self, label, total)
+        self.counters.append(counter)
+        return counter
+
+    def invalidate(self):
+        pass
+
+    def set_status(self, status, error=None):
+        self.status, self.error = status, error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        pass
+
+
+class JsonlProgress(NullProgress):
+    """
+    Writes a JSON record every period seconds (and a final one on exit) to
+    file (default: stdout)
+    """
+
+    def __init__(self, title=None, file=None, period=1.0, **kwargs):
+        super().__init__(title=title)
+        self.file = sys.stdout if file is None else file
+        self.period = period
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self.run, name="JsonlProgress", daemon=True
+        )
+
+    def record(self):
+        now = time.time()
+        counters = {}
+        for counter in self.counters:
+            elapsed = counter.time_elapsed.total_seconds()
+            counters[counter.label_text] = dict(
+                value=counter.items_completed,
+                total=counter.total,
+                fps=counter.items_completed / elapsed if elapsed > 0 else 0.0,
+            )
+        return dict(
+            time=now, elapsed=now - self.start, title=self.title,
+            status=self.status, error=self.error, counters=counters,
+        )
+
+    def write(self):
+        self.file.write(json.dumps(self.record()) + "\n")
+        self.file.flush()
+
+    def run(self):
+        while not self._stop.wait(self.period):
+            self.write()
+
+    def __enter__(self):
+        self.start = time.time()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.write()
@@ -0,0 +1,136 @@
+"""
+Soak test book keeping: per iteration prepare time, sustained frame rate
+and process memory of repeated acquisitions, and detection of slow
+degradation (throughput drift, memory growth) across iterations.
+
+The first *window* iterations are the reference (warm up: buffers are
+allocated, caches filled...). Throughput drift compares the mean frame rate
+of the last window with the reference one. Memory growth is the RSS increase
+since the end of the reference window.
+"""
+
+import os
+import time
+import statistics
+import collections
+
+Iteration = collections.namedtuple(
+    "Iteration", "index prepare_time elapsed fps rss error"
+)
+
+
+def rss():
+    """resident set size (bytes) of this process"""
+    with open("/proc/self/statm") as fobj:
+        return int(fobj.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def iterations(repeat=0, duration=0):
+    """
+    Iteration indexes until repeat iterations are done or duration seconds
+    elapsed (0: no limit)
+    """
+    stop = time.monotonic() + duration if duration else None
+    index = 0
+    while not repeat or index < repeat:
+        if stop is not None and time.monotonic() >= stop:
+            break
+        yield index
+        index += 1
+
+
+def slope(values):
+    """least squares slope of values against their index"""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    x_mean, y_mean = (n - 1) / 2, statistics.mean(values)
+    num = sum((x - x_mean) * (y - y_mean) for x, y in enumerate(values))
+    den = sum((x - x_mean) ** 2 for x in range(n))
+    return num / den
+
+
+class SoakRecorder:
+
+    def __init__(self, window=5):
+        self.window = window
+        self.iterations = []
+
+    def add(self, measurement, memory):
+        iteration = Iteration(
+            len(self.iterations), measurement.prepare_time, measurement.elapsed,
+            measurement.fps, memory, measurement.error
+        )
+        self.iterations.append(iteration)
+        return iteration
+
+    def fps_drift(self):
+        """relative change of the last window mean fps (None: too few iterations)"""
+        fps = [i.fps for i in self.iterations]
+        if len(fps) < 2 * self.window:
+            return None
+        reference = statistics.mean(fps[:self.window])
+        if reference <= 0:
+            return None
+        return statistics.mean(fps[-self.window:]) / reference - 1
+
+    def rss_growth(self):
+        """(growth in bytes, growth per iteration) after the reference window"""
+        memory = [i.rss for i in self.iterations[self.window - 1:]]
+        if len(memory) < 2:
+            return None, None
+        return memory[-1] - memory[0], slope(memory)
+
+    def warnings(self, drift_tolerance, leak_tolerance):
+        """
+        messages for a fps drift beyond drift_tolerance (fraction) or a memory
+        growth beyond leak_tolerance (bytes)
+        """
+        result = []
+        drift = self.fps_drift()
+        if drift is not None and abs(drift) > drift_tolerance:
+            result.append(f"throughput drift: {drift:+.1%}")
+        growth, rate = self.rss_growth()
+        if growth is not None and growth > leak_tolerance and rate > 0:
+            result.append(
+                f"memory growth: {growth / 1e6:+.1f} MB "
+                f"({rate / 1e6:+.3f} MB/iteration)"
+            )
+        nb_errors = sum(1 for i in self.iterations if i.error)
+        if nb_errors:
+            result.append(f"{nb_errors} iteration(s) stopped on error")
+        return result
+
+    def iteration_text(self, iteration):
+        delta = iteration.rss - self.iterations[0].rss
+        text = (
+            f"#{iteration.index + 1} prepare {iteration.prepare_time * 1e3:.1f} ms | "
+            f"{iteration.fps:.1f} fps | RSS {iteration.rss / 1e6:.1f} MB "
+            f"({delta / 1e6:+.1f} MB)"
+        )
+        if iteration.error:
+            text += f" | {iteration.error}"
+        return text
+
+    def summary_text(self):
+        items = self.iterations
+        if not items:
+            return "Soak: no iteration"
+        fps = [i.fps for i in items]
+        prepare = [i.prepare_time * 1e3 for i in items]
+        elapsed = sum(i.prepare_time + i.elapsed for i in items)
+        lines = [
+            f"Soak: {len(items)} iterations ({elapsed:.1f} s)",
+            f"  fps: min {min(fps):.1f} | mean {statistics.mean(fps):.1f} | "
+            f"max {max(fps):.1f}",
+            f"  prepare (ms): min {min(prepare):.1f} | mean "
+            f"{statistics.mean(prepare):.1f} | max {max(prepare):.1f}",
+            f"  RSS: {items[0].rss / 1e6:.1f} MB -> {items[-1].rss / 1e6:.1f} MB",
+        ]
+        drift = self.fps_drift()
+        if drift is not None:
+            lines.append(
+                f"  fps drift (last {self.window} vs first {self.window}): "
+                f"{drift:+.1%}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,150 @@
+"""
+Helpers to manage the files of the saving directory.
+"""
+
+import os
+import sys
+import stat
+import time
+import shutil
+import pathlib
+import tempfile
+import contextlib
+import subprocess
+import concurrent.futures
+
+# write speed test: size of the written blocks and maximum file size
+BLOCK_SIZE = 1 << 20
+MAX_FILE_SIZE = 256 << 20
+
+
+def matches(name, prefix, suffix):
+    return (
+        len(name) >= len(prefix) + len(suffix)
+        and name.startswith(prefix)
+        and name.endswith(suffix)
+    )
+
+
+def iter_files(directory, prefix="", suffix=""):
+    """Stream the regular files (os.DirEntry) named <prefix>*<suffix>"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not matches(entry.name, prefix, suffix):
+                continue
+            if entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def only_contains(directory, prefix="", suffix=""):
+    """True if every entry of directory is a file named <prefix>*<suffix>"""
+    with os.scandir(directory) as entries:
+        return all(
+            matches(entry.name, prefix, suffix) and entry.is_file(follow_symlinks=False)
+            for entry in entries
+        )
+
+
+def remove_files(paths, nb_tasks=8, callback=None):
+    """
+    Remove files from a pool of nb_tasks threads. paths can be a lazy
+    iterable: at most 2 x nb_tasks removals are queued at any time.
+    callback(nb_removed) is called as removals complete.
+    Returns the number of files removed.
+    """
+    removed = 0
+
+    def collect(done):
+        nonlocal removed
+        for future in done:
+            try:
+                future.result()
+            except FileNotFoundError:
+                continue
+            removed += 1
+        if callback is not None:
+            callback(removed)
+
+    wait = concurrent.futures.wait
+    with concurrent.futures.ThreadPoolExecutor(nb_tasks) as executor:
+        pending = set()
+        for path in paths:
+            pending.add(executor.submit(os.remove, path))
+            if len(pending) >= 2 * nb_tasks:
+                done, pending = wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                collect(done)
+        collect(wait(pending).done)
+    return removed
+
+
+def remove_directory_in_background(directory):
+    """
+    Rename directory aside, recreate it empty (same permissions) and
+    remove the renamed one in a detached process which outlives this one.
+    Returns the path of the directory being removed.
+    """
+    path = pathlib.Path(directory).resolve()
+    trash = path.with_name(f".{path.name}.trash-{os.getpid()}-{time.time():.0f}")
+    mode = stat.S_IMODE(path.stat().st_mode)
+    os.rename(str(path), str(trash))
+    path.mkdir()
+    os.chmod(str(path), mode)
+    code = "import shutil, sys; shutil.rmtree(sys.argv[1], ignore_errors=True)"
+    subprocess.Popen(
+        [sys.executable, "-c", code, str(trash)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    return trash
+
+
+@contextlib.contextmanager
+def scratch_directory(directory, name="scratch"):
+    """
+    Private temporary sub-directory of directory (same file system),
+    removed with its content on exit. Probe acquisitions save there so
+    they never overwrite nor remove files of the user
+    """
+    path = tempfile.mkdtemp(prefix=f".limatb-{name}-", dir=directory)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def measure_write_speed(directory, file_size, nb_writers=1, duration=2.0):
+    """
+    Sustained write throughput (bytes/s) of directory: nb_writers threads
+    write (and fsync) files of file_size bytes (capped to MAX_FILE_SIZE)
+    during duration seconds. Random data is used so compressing file
+    systems don't fool the measurement. Test files are removed.
+    """
+    file_size = max(1, min(int(file_size), MAX_FILE_SIZE))
+    block = memoryview(os.urandom(min(file_size, BLOCK_SIZE)))
+    tmp_dir = tempfile.mkdtemp(prefix=".limatb-write-test-", dir=directory)
+    stop = time.monotonic() + duration
+
+    def write(writer):
+        written, index = 0, 0
+        while not written or time.monotonic() < stop:
+            path = os.path.join(tmp_dir, f"{writer}-{index}")
+            with open(path, "wb", buffering=0) as fobj:
+                remaining = file_size
+                while remaining > 0:
+                    remaining -= fobj.write(block[:remaining])
+                os.fsync(fobj.fileno())
+            os.remove(path)
+            written += file_size
+            index += 1
+        return written
+
+    try:
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(nb_writers) as executor:
+            written = sum(executor.map(write, range(nb_writers)))
+        elapsed = time.monotonic() - start
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return written / elapsed
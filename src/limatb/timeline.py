@@ -0,0 +1,141 @@
+"""
+Per frame acquisition timeline.
+
+Records the time at which each frame crosses each Lima pipeline stage
+(acquired, base ready, ready, saved) from the image counters and
+computes stage throughput and latency statistics.
+"""
+
+import csv
+import sys
+import math
+import time
+import array
+import struct
+
+STAGES = (
+    ("acquired", "LastImageAcquired"),
+    ("base_ready", "LastBaseImageReady"),
+    ("ready", "LastImageReady"),
+    ("saved", "LastImageSaved"),
+)
+
+LATENCIES = (
+    ("acquired", "ready"),
+    ("ready", "saved"),
+)
+
+# binary timeline: magic, nb. stages, nb. frames followed by one float64
+# array (seconds since start, NaN if never reached) per stage
+BINARY_MAGIC = b"LIMATBTL"
+BINARY_HEADER = struct.Struct("<8sII")
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a sorted sequence"""
+    if not values:
+        return math.nan
+    rank = math.ceil(p / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+class TimelineRecorder:
+    """
+    Collects the timestamp of every frame for every stage.
+
+    Counters are cumulative so frames skipped between two updates get the
+    timestamp of the update which reported them: the resolution is the
+    one of the monitor (use event monitoring for a finer one).
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.stamps = {name: array.array("d") for name, _ in STAGES}
+
+    def record(self, counters, when=None):
+        when = self.clock() if when is None else when
+        t = when - self.start
+        for name, field in STAGES:
+            stamps = self.stamps[name]
+            missing = getattr(counters, field) + 1 - len(stamps)
+            if missing > 0:
+                stamps.extend([t] * missing)
+
+    @property
+    def nb_frames(self):
+        return max(len(stamps) for stamps in self.stamps.values())
+
+    def throughput(self, stage):
+        """frames per second at which frames crossed the given stage"""
+        stamps = self.stamps[stage]
+        if len(stamps) < 2 or stamps[-1] <= stamps[0]:
+            return math.nan
+        return (len(stamps) - 1) / (stamps[-1] - stamps[0])
+
+    def latencies(self, start, end):
+        """sorted list of per frame latencies between two stages"""
+        begin, finish = self.stamps[start], self.stamps[end]
+        return sorted(finish[i] - begin[i] for i in range(min(len(begin), len(finish))))
+
+    def summary(self):
+        result = {
+            "throughput": {name: self.throughput(name) for name, _ in STAGES},
+            "latency": {},
+        }
+        for start, end in LATENCIES:
+            values = self.latencies(start, end)
+            result["latency"][f"{start}->{end}"] = {
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1] if values else math.nan,
+            }
+        return result
+
+    def summary_text(self):
+        summary = self.summary()
+        lines = []
+        for name, _ in STAGES:
+            if not self.stamps[name]:
+                continue
+            fps = summary["throughput"][name]
+            lines.append(f"{name:>15}: {len(self.stamps[name])} frames, {fps:.1f} fps")
+        for name, stats in summary["latency"].items():
+            if math.isnan(stats["p50"]):
+                continue
+            values = ", ".join(
+                f"{key} {value * 1e3:.2f} ms" for key, value in stats.items()
+            )
+            lines.append(f"{name:>15}: {values}")
+        return "\n".join(lines)
+
+    def rows(self):
+        nan = math.nan
+        stamps = [self.stamps[name] for name, _ in STAGES]
+        for frame in range(self.nb_frames):
+            yield [frame] + [s[frame] if frame < len(s) else nan for s in stamps]
+
+    def write_csv(self, stream):
+        writer = csv.writer(stream)
+        writer.writerow(["frame"] + [name for name, _ in STAGES])
+        writer.writerows(self.rows())
+
+    def write_binary(self, stream):
+        nb_frames = self.nb_frames
+        stream.write(BINARY_HEADER.pack(BINARY_MAGIC, len(STAGES), nb_frames))
+        for name, _ in STAGES:
+            stamps = array.array("d", self.stamps[name])
+            stamps.extend([math.nan] * (nb_frames - len(stamps)))
+            if sys.byteorder == "big":
+                stamps.byteswap()
+            stamps.tofile(stream)
+
+    def save(self, filename):
+        """write timeline as CSV (*.csv) or compact binary (anything else)"""
+        if str(filename).lower().endswith(".csv"):
+            with open(filename, "w", newline="") as stream:
+                self.write_csv(stream)
+        else:
+            with open(filename, "wb") as stream:
+                self.write_binary(stream)
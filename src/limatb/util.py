@@ -1,82 +1,137 @@
 import sys
-import asyncio
 import pathlib
 import functools
+import threading
+import concurrent.futures
 
-import pint
 import click
-import Lima.Core
-from Lima.Core import CtControl, CtSaving
-
-
-ur = pint.UnitRegistry()
-
-
-ErrorMap = {
-    CtControl.NoError:           "No error",
-    CtControl.SaveUnknownError:  "Saving error",
-    CtControl.SaveOpenError:     "Save file open error",
-    CtControl.SaveCloseError:    "Save file close error",
-    CtControl.SaveAccessError:   "Save access error",
-    CtControl.SaveOverwriteError: "Save overwrite error",
-    CtControl.SaveDiskFull:      "Save disk full",
-    CtControl.SaveOverun:        "Save overrun",
-    CtControl.ProcessingOverun:  "Soft Processing overrun",
-    CtControl.CameraError:       "Camera Error",
-}
-
-
-FileFormat = {
-    "hardware": CtSaving.HARDWARE_SPECIFIC,
-    "raw": CtSaving.RAW,
-    "edf": CtSaving.EDF,
-    "edf-gz": CtSaving.EDFGZ,
-    "edf-lz4": CtSaving.EDFLZ4,
-    "edf-concat": CtSaving.EDFConcat,
-    "cbf": CtSaving.CBFFormat,
-    "cbf-mh": CtSaving.CBFMiniHeader,
-    "nxs": CtSaving.NXS,
-    "fits": CtSaving.FITS,
-    "tiff": CtSaving.TIFFFormat,
-    "hdf5": CtSaving.HDF5,
-    "hdf5-gz": CtSaving.HDF5GZ,
-    "hdf5-bs": CtSaving.HDF5BS,
-}
-
-
-SavingPolicy = {
-    "abort": CtSaving.Abort,
-    "overwrite": CtSaving.Overwrite,
-    "append": CtSaving.Append
-}
-if hasattr(CtSaving, "MultiSet"):
-    SavingPolicy["multiset"] = CtSaving.MultiSet
-
-
-SavingMode = {
-    "manual": CtSaving.Manual,
-    "auto-frame": CtSaving.AutoFrame,
-    "auto-header": CtSaving.AutoHeader
-}
-
-
-SavingManagedMode = {
-    "software": CtSaving.Software,
-    "hardware": CtSaving.Hardware
-}
-if hasattr(CtSaving, "Camera"):
-    SavingPolicy["camera"] = CtSaving.Camera
-
-
-TriggerMode = {
-    "int": Lima.Core.IntTrig,
-    "int-mult": Lima.Core.IntTrigMult,
-    "ext-single": Lima.Core.ExtTrigSingle,
-    "ext-mult": Lima.Core.ExtTrigMult,
-    "ext-gate": Lima.Core.ExtGate,
-    "ext-start-stop": Lima.Core.ExtStartStop,
-    "ext-readout": Lima.Core.ExtTrigReadout
-}
+
+
+@functools.lru_cache(maxsize=None)
+def unit_registry():
+    """Shared pint unit registry (created on first use: it is slow to build)"""
+    import pint
+    return pint.UnitRegistry()
+
+
+def __getattr__(name):
+    # backward compatible (lazy) access to the former module level registry
+    # and Lima maps
+    if name == "ur":
+        return unit_registry()
+    if name in LIMA_MAPS:
+        return lima_maps()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def call_in_daemon_thread(func):
+    """
+    Future of func() executed in a daemon thread: a call which never
+    returns (ex: detector getter, blocking scan) doesn't prevent the process
+    from exiting. Use asyncio.wrap_future to await it
+    """
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except Exception as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+# Lima enumeration maps: built on first use so importing limatb.util (ex:
+# from the camera plugins) doesn't import Lima
+LIMA_MAPS = (
+    "ErrorMap", "AcqStatusMap", "FileFormat", "SavingPolicy", "SavingMode",
+    "SavingManagedMode", "TriggerMode",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def lima_maps():
+    """Lima enumeration maps (Lima.Core is imported on first use)"""
+    from Lima import Core
+    from Lima.Core import CtControl, CtSaving
+
+    ErrorMap = {
+        CtControl.NoError:           "No error",
+        CtControl.SaveUnknownError:  "Saving error",
+        CtControl.SaveOpenError:     "Save file open error",
+        CtControl.SaveCloseError:    "Save file close error",
+        CtControl.SaveAccessError:   "Save access error",
+        CtControl.SaveOverwriteError: "Save overwrite error",
+        CtControl.SaveDiskFull:      "Save disk full",
+        CtControl.SaveOverun:        "Save overrun",
+        CtControl.ProcessingOverun:  "Soft Processing overrun",
+        CtControl.CameraError:       "Camera Error",
+    }
+
+    AcqStatusMap = {
+        Core.AcqReady: "Ready",
+        Core.AcqRunning: "Running",
+        Core.AcqFault: "Fault",
+        Core.AcqConfig: "Configuration",
+    }
+
+    FileFormat = {
+        "hardware": CtSaving.HARDWARE_SPECIFIC,
+        "raw": CtSaving.RAW,
+        "edf": CtSaving.EDF,
+        "edf-gz": CtSaving.EDFGZ,
+        "edf-lz4": CtSaving.EDFLZ4,
+        "edf-concat": CtSaving.EDFConcat,
+        "cbf": CtSaving.CBFFormat,
+        "cbf-mh": CtSaving.CBFMiniHeader,
+        "nxs": CtSaving.NXS,
+        "fits": CtSaving.FITS,
+        "tiff": CtSaving.TIFFFormat,
+        "hdf5": CtSaving.HDF5,
+        "hdf5-gz": CtSaving.HDF5GZ,
+        "hdf5-bs": CtSaving.HDF5BS,
+    }
+
+    SavingPolicy = {
+        "abort": CtSaving.Abort,
+        "overwrite": CtSaving.Overwrite,
+        "append": CtSaving.Append
+    }
+    if hasattr(CtSaving, "MultiSet"):
+        SavingPolicy["multiset"] = CtSaving.MultiSet
+
+    SavingMode = {
+        "manual": CtSaving.Manual,
+        "auto-frame": CtSaving.AutoFrame,
+        "auto-header": CtSaving.AutoHeader
+    }
+
+    SavingManagedMode = {
+        "software": CtSaving.Software,
+        "hardware": CtSaving.Hardware
+    }
+    if hasattr(CtSaving, "Camera"):
+        SavingPolicy["camera"] = CtSaving.Camera
+
+    TriggerMode = {
+        "int": Core.IntTrig,
+        "int-mult": Core.IntTrigMult,
+        "ext-single": Core.ExtTrigSingle,
+        "ext-mult": Core.ExtTrigMult,
+        "ext-gate": Core.ExtGate,
+        "ext-start-stop": Core.ExtStartStop,
+        "ext-readout": Core.ExtTrigReadout
+    }
+
+    return dict(
+        ErrorMap=ErrorMap, AcqStatusMap=AcqStatusMap, FileFormat=FileFormat,
+        SavingPolicy=SavingPolicy, SavingMode=SavingMode,
+        SavingManagedMode=SavingManagedMode, TriggerMode=TriggerMode,
+    )
+
 
 # ModuleNotFoundError added in python 3.6
 try:
@@ -91,8 +146,8 @@ class CameraNotFoundError(click.ClickException):
 
 def get_lima_camera_names():
     """Find installed lima cameras"""
+    import Lima
     cameras = []
-    path = Lima.__path__
     for path in Lima.__path__:
         path = pathlib.Path(path)
         if path.is_dir():
@@ -113,28 +168,3 @@ def camera_module(name):
         return load('Lima.' + name)
     except ModuleNotFoundError:
         raise CameraNotFoundError('{} is not installed'.format(name))
-
-
-async def scan(scans, timeout):
-    loop = asyncio.get_running_loop()
-
-    async def detector_scan(scan, name, timeout):
-        if asyncio.iscoroutinefunction(scan):
-            task = asyncio.create_task(scan(timeout=timeout))
-        else:
-            scan = functools.partial(scan, timeout=timeout)
-            task = loop.run_in_executor(None, scan)
-        return name, (await task)
-
-    tasks = []
-    for name, scan in scans:
-        task = asyncio.create_task(detector_scan(scan, name, timeout=timeout))
-        tasks.append(task)
-
-    tables, errors = [], []
-    for future in asyncio.as_completed(tasks, timeout=timeout+0.1):
-        try:
-            tables.append(await future)
-        except Exception as error:
-            errors.append(error)
-    return tables, errors
@@ -0,0 +1,229 @@
+"""
+Verification of the saved files: nb. of files and frames, header
+consistency, truncated files and read back speed.
+
+Files are read in parallel. EDF headers are parsed from a memory map of
+the file and HDF5 frames are read one by one through the (lazy) h5py
+dataset. All the data is read back (crc32) to measure the read speed.
+Other formats are only checked for their size and read back.
+"""
+
+import os
+import mmap
+import math
+import time
+import zlib
+import collections
+import concurrent.futures
+
+import click
+
+from .storage import iter_files
+
+FileReport = collections.namedtuple(
+    "FileReport", "path size nb_frames header nb_bytes error"
+)
+
+VerifyResult = collections.namedtuple(
+    "VerifyResult", "nb_files nb_frames nb_bytes elapsed errors"
+)
+
+EDF_TYPE_SIZES = {
+    "UnsignedByte": 1, "SignedByte": 1, "UnsignedShort": 2, "SignedShort": 2,
+    "UnsignedInteger": 4, "SignedInteger": 4, "UnsignedLong": 4, "SignedLong": 4,
+    "Unsigned64": 8, "Signed64": 8, "FloatValue": 4, "DoubleValue": 8,
+}
+
+
+def parse_edf_header(text):
+    header = {}
+    for line in text.splitlines():
+        if "=" in line:
+            key, value = line.split("=", 1)
+            header[key.strip()] = value.strip().rstrip(";").strip()
+    return header
+
+
+def edf_data_size(header):
+    if "Size" in header:
+        return int(header["Size"])
+    return (
+        int(header["Dim_1"]) * int(header.get("Dim_2", 1)) *
+        EDF_TYPE_SIZES[header["DataType"]]
+    )
+
+
+def iter_edf_frames(buff):
+    """(header, data offset, data size) of each EDF block of buff"""
+    offset, size = 0, len(buff)
+    while offset < size:
+        start = buff.find(b"{", offset)
+        if start < 0:
+            break
+        end = buff.find(b"}", start)
+        if end < 0:
+            raise ValueError(f"unterminated EDF header at {start}")
+        data = end + 1
+        if buff[data:data + 1] == b"\n":
+            data += 1
+        header = parse_edf_header(buff[start + 1:end].decode("ascii", "replace"))
+        data_size = edf_data_size(header)
+        if data + data_size > size:
+            missing = data + data_size - size
+            raise ValueError(f"truncated frame at {data} (missing {missing} bytes)")
+        yield header, data, data_size
+        offset = data + data_size
+
+
+def frame_signature(header):
+    keys = ("Dim_1", "Dim_2", "DataType", "ByteOrder")
+    return tuple(header.get(key) for key in keys)
+
+
+def read_edf(path):
+    nb_frames, nb_bytes, signature = 0, 0, None
+    with open(path, "rb") as fobj:
+        with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as buff:
+            view = memoryview(buff)
+            try:
+                for header, offset, data_size in iter_edf_frames(buff):
+                    frame = frame_signature(header)
+                    if signature is None:
+                        signature = frame
+                    elif frame != signature:
+                        raise ValueError(
+                            f"frame {nb_frames} header {frame} != {signature}"
+                        )
+                    zlib.crc32(view[offset:offset + data_size])
+                    nb_frames += 1
+                    nb_bytes += data_size
+            finally:
+                view.release()
+    return nb_frames, signature, nb_bytes
+
+
+def frames_dataset(h5):
+    """first dataset with a frame stack shape (nb. frames, height, width)"""
+    found = []
+
+    def visit(name, item):
+        if getattr(item, "ndim", 0) == 3:
+            found.append(item)
+            return True
+
+    h5.visititems(visit)
+    if not found:
+        raise ValueError("no frame dataset")
+    return found[0]
+
+
+def import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise click.ClickException(
+            "h5py is needed to verify HDF5 files "
+            "(pip install lima-toolbox[hdf5])"
+        )
+    return h5py
+
+
+def read_hdf5(path):
+    h5py = import_h5py()
+    with h5py.File(path, "r") as h5:
+        dataset = frames_dataset(h5)
+        nb_frames = dataset.shape[0]
+        nb_bytes = 0
+        for index in range(nb_frames):
+            frame = dataset[index]
+            zlib.crc32(frame.tobytes())
+            nb_bytes += frame.nbytes
+        return nb_frames, (dataset.shape[1:], str(dataset.dtype)), nb_bytes
+
+
+def read_other(path):
+    nb_bytes = 0
+    with open(path, "rb") as fobj:
+        for block in iter(lambda: fobj.read(1 << 20), b""):
+            zlib.crc32(block)
+            nb_bytes += len(block)
+    return None, None, nb_bytes
+
+
+READERS = (
+    (".edf", read_edf),
+    (".h5", read_hdf5),
+    (".hdf5", read_hdf5),
+    (".hdf", read_hdf5),
+)
+
+
+def reader(path):
+    for suffix, read in READERS:
+        if path.endswith(suffix):
+            return read
+    return read_other
+
+
+def read_file(path):
+    size = os.path.getsize(path)
+    if not size:
+        return FileReport(path, size, 0, None, 0, "empty file")
+    try:
+        nb_frames, header, nb_bytes = reader(path)(path)
+    except Exception as error:
+        return FileReport(path, size, None, None, 0, repr(error))
+    return FileReport(path, size, nb_frames, header, nb_bytes, None)
+
+
+def file_order(name, prefix, suffix):
+    """sort key: numeric index of <prefix><index><suffix> (then name)"""
+    index = name[len(prefix):len(name) - len(suffix)]
+    return (0, int(index), name) if index.isdigit() else (1, 0, name)
+
+
+def check(reports, nb_frames, frames_per_file):
+    """error messages comparing the file reports with what was expected"""
+    errors = [f"{os.path.basename(r.path)}: {r.error}" for r in reports if r.error]
+    nb_files = math.ceil(nb_frames / frames_per_file)
+    if len(reports) != nb_files:
+        errors.append(f"{len(reports)} files (expected {nb_files})")
+    counted = [r for r in reports if r.nb_frames is not None]
+    for index, report in enumerate(reports):
+        if report.nb_frames is None:
+            continue
+        last = index == nb_files - 1
+        expected = nb_frames - index * frames_per_file if last else frames_per_file
+        if report.nb_frames != expected:
+            errors.append(
+                f"{os.path.basename(report.path)}: {report.nb_frames} frames "
+                f"(expected {expected})"
+            )
+    if counted and len(counted) == len(reports):
+        total = sum(r.nb_frames for r in counted)
+        if total != nb_frames:
+            errors.append(f"{total} frames (expected {nb_frames})")
+    headers = {r.header for r in reports if r.header is not None}
+    if len(headers) > 1:
+        headers = sorted(map(str, headers))
+        errors.append(f"inconsistent frame headers between files: {headers}")
+    return errors
+
+
+def verify(directory, prefix, suffix, nb_frames, frames_per_file=1, nb_tasks=4):
+    """Read back the saved files in nb_tasks threads and check them"""
+    entries = sorted(
+        iter_files(directory, prefix, suffix),
+        key=lambda entry: file_order(entry.name, prefix, suffix)
+    )
+    paths = [entry.path for entry in entries]
+    if any(reader(path) is read_hdf5 for path in paths):
+        import_h5py()
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(nb_tasks) as executor:
+        reports = list(executor.map(read_file, paths))
+    elapsed = time.monotonic() - start
+    errors = check(reports, nb_frames, frames_per_file)
+    frames = sum(r.nb_frames or 0 for r in reports)
+    nb_bytes = sum(r.nb_bytes for r in reports)
+    return VerifyResult(len(reports), frames, nb_bytes, elapsed, errors)
@@ -0,0 +1,32 @@
+from limatb.autotune import Probe, choose, hill_climb, ladders
+
+
+def probe(fps, cpu=1.0, error=None, **config):
+    return Probe(config, fps, cpu, error)
+
+
+def test_choose_least_cpu_sustaining():
+    probes = [probe(1000, 2.0), probe(1100, 1.0), probe(1500, 0.5, "Save overrun")]
+    assert choose(probes, 1000) is probes[1]
+
+
+def test_choose_skips_errors():
+    # an acquisition stopped on overrun may show the best fps
+    probes = [probe(900), probe(1500, error="Save overrun")]
+    assert choose(probes, 1000) is probes[0]
+
+
+def test_choose_all_failed():
+    probes = [probe(900, error="Processing overrun"), probe(1500, error="Save overrun")]
+    assert choose(probes, 1000) is None
+
+
+def test_hill_climb():
+    # throughput grows with the nb. of saving tasks up to 4
+    def measure(config):
+        return probe(min(config["nb_saving_tasks"], 4) * 100, **config)
+
+    start = dict(nb_saving_tasks=1, nb_processing_tasks=1, saving_nb_frames_per_file=1)
+    probes = hill_climb(measure, start, ladders()[:1])
+    assert max(p.fps for p in probes) == 400
+    assert {p.config["nb_saving_tasks"] for p in probes} == {1, 2, 4, 8}
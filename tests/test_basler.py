@@ -0,0 +1,64 @@
+from limatb.camera.basler import (
+    TransportPoint, TransportRun, transport_points, sweep_transport,
+    best_transport, dropped_frames,
+)
+
+
+def fake_run_point(runs):
+    """run_point returning the given TransportRun of each point in turn"""
+    calls = []
+
+    def run_point(point):
+        calls.append(point)
+        return runs[point].pop(0)
+
+    return run_point, calls
+
+
+def test_transport_points():
+    points = transport_points([1500, 8192], [0, 1000], [0])
+    assert points == [
+        TransportPoint(1500, 0, 0), TransportPoint(1500, 1000, 0),
+        TransportPoint(8192, 0, 0), TransportPoint(8192, 1000, 0),
+    ]
+
+
+def test_sweep_transport():
+    small = TransportPoint(1500, 0, 0)
+    big = TransportPoint(8192, 0, 0)
+    big_delay = TransportPoint(8192, 1000, 0)
+    runs = {
+        small: [TransportRun(80, 0, None), TransportRun(82, 0, None)],
+        big: [TransportRun(100, 3, None), TransportRun(100, 0, None)],
+        big_delay: [TransportRun(96, 0, None), TransportRun(90, 0, "Camera Error")],
+    }
+    run_point, calls = fake_run_point(runs)
+    reported = []
+    results = sweep_transport(run_point, [small, big, big_delay], 2, reported.append)
+    assert calls == [small, small, big, big, big_delay, big_delay]
+    assert reported == results
+    assert [(r.fps, r.drops, r.errors) for r in results] == [
+        (81, 0, []), (100, 3, []), (93, 0, ["Camera Error"])
+    ]
+    # fastest point drops frames, the next one has an error
+    assert best_transport(results).point == small
+
+
+def test_best_transport():
+    points = transport_points([8192], [0, 1000, 4000], [0])
+    runs = {point: [TransportRun(100, 0, None)] for point in points}
+    results = sweep_transport(fake_run_point(runs)[0], points)
+    # equal fps: the smallest delay wins
+    assert best_transport(results).point == TransportPoint(8192, 0, 0)
+    runs = {point: [TransportRun(100, 1, None)] for point in points}
+    results = sweep_transport(fake_run_point(runs)[0], points)
+    assert best_transport(results) is None
+
+
+def test_dropped_frames():
+    assert dropped_frames(5, 5, 100, 100) == 0
+    assert dropped_frames(5, 8, 100, 100) == 3
+    # statistics reset at acquisition start
+    assert dropped_frames(5, 2, 100, 100) == 2
+    # missing frames count as dropped
+    assert dropped_frames(0, 1, 100, 95) == 6
@@ -0,0 +1,33 @@
+import sys
+import subprocess
+
+# modules which must not be imported just to display the top level help
+HEAVY_MODULES = ("Lima", "limatb.camera", "limatb.acquire", "limatb.bench")
+
+IMPORTED_MODULES = """
+import sys
+from limatb.cli import cli
+try:
+    cli(["--help"])
+except SystemExit:
+    pass
+print()
+print(" ".join(sys.modules))
+"""
+
+
+def help_modules():
+    """modules imported by a fresh interpreter running limatb --help"""
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORTED_MODULES], universal_newlines=True
+    )
+    return output.splitlines()[-1].split()
+
+
+def test_help_is_lazy():
+    modules = help_modules()
+    heavy = [
+        name for name in modules
+        if any(name == h or name.startswith(h + ".") for h in HEAVY_MODULES)
+    ]
+    assert heavy == []
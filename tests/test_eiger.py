@@ -0,0 +1,211 @@
+import json
+import socket
+import asyncio
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from limatb.cli import cli  # noqa: E402
+from limatb.cache import Cache  # noqa: E402
+
+CONFIG = {
+    "detector/config": {"count_time": 0.1, "nimages": 10, "flatfield": [1, 2]},
+    "detector/status": {"temperature": 30.0},
+    "stream/config": {"mode": "enabled"},
+    "stream/status": {"state": "ready"},
+}
+
+
+def simplon_app(config):
+    """SIMPLON API stand-in serving config ({section: {key: value}})"""
+
+    async def version(request):
+        return web.json_response({"value": "1.8.0"})
+
+    async def keys(request):
+        section = "{sub}/{kind}".format(**request.match_info)
+        return web.json_response(list(config[section]))
+
+    async def value(request):
+        section = "{sub}/{kind}".format(**request.match_info)
+        key = request.match_info["key"]
+        return web.json_response({"value": config[section][key]})
+
+    app = web.Application()
+    app.router.add_get("/detector/api/version/", version)
+    app.router.add_get("/{sub}/api/{version}/{kind}/keys", keys)
+    app.router.add_get("/{sub}/api/{version}/{kind}/{key}", value)
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def detectors():
+    """two stand-in detectors (nimages differ) and a closed port"""
+    other = json.loads(json.dumps(CONFIG))
+    other["detector/config"]["nimages"] = 20
+    loop = asyncio.new_event_loop()
+    runners, hosts = [], []
+
+    async def start():
+        for config in (CONFIG, other):
+            runner = web.AppRunner(simplon_app(config))
+            await runner.setup()
+            port = free_port()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+            runners.append(runner)
+            hosts.append(f"127.0.0.1:{port}")
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(start(), loop).result(10)
+    yield hosts + [f"127.0.0.1:{free_port()}"]
+    for runner in runners:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def run(*args):
+    return CliRunner().invoke(cli, ["eiger", "config"] + list(args))
+
+
+def test_config_dump(detectors, tmp_path):
+    reference = str(tmp_path / "reference.json")
+    result = run("dump", detectors[0], "-o", reference)
+    assert result.exit_code == 0, result.output
+    with open(reference) as fobj:
+        snapshot = json.load(fobj)["detectors"][detectors[0]]
+    assert snapshot["version"] == "1.8.0"
+    assert snapshot["detector/config"] == {"count_time": 0.1, "nimages": 10}
+    assert snapshot["stream/status"] == {"state": "ready"}
+
+
+def test_config_diff(detectors, tmp_path):
+    reference = str(tmp_path / "reference.json")
+    run("dump", detectors[0], "-o", reference)
+
+    result = run("diff", reference, detectors[0])
+    assert result.exit_code == 0, result.output
+    assert "No differences" in result.output
+
+    result = run("diff", reference, detectors[1])
+    assert result.exit_code == 1, result.output
+    assert "detector/config/nimages" in result.output
+
+
+def test_config_diff_fetch_error(detectors, tmp_path):
+    reference = str(tmp_path / "reference.json")
+    run("dump", detectors[0], "-o", reference)
+    result = run("diff", reference, detectors[0], detectors[2], "--timeout", "1")
+    assert result.exit_code == 2, result.output
+    assert f"{detectors[2]}: not compared" in result.output
+    assert "count_time" not in result.output
+
+
+def detector_dict(address):
+    return dict(
+        name=address, aliases=[], addresses=[address], port=8000,
+        version="1.8.0", address=address,
+    )
+
+
+@pytest.fixture
+def discovery(monkeypatch, tmp_path):
+    """
+    run(stop=False, **kwargs) -> (addresses, cache entry, refreshes) of
+    iter_cached_detectors (stopped after the first detector if stop) with
+    a fake sweep (run.sweep) and version check
+    """
+    from limatb.camera import eiger
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    refreshes = []
+    monkeypatch.setattr(
+        eiger, "refresh_in_background", lambda *args: refreshes.append(args)
+    )
+
+    async def iter_detectors(port, timeout):
+        for address in ("10.0.0.1", "10.0.0.2"):
+            yield eiger.detector_from_dict(detector_dict(address))
+
+    async def iter_versions(addresses, port, timeout):
+        for address in addresses:
+            yield address, "1.8.0"
+
+    monkeypatch.setattr(eiger, "iter_versions", iter_versions)
+
+    def run(stop=False, **kwargs):
+        monkeypatch.setattr(eiger, "iter_detectors", run.sweep)
+
+        async def discover():
+            found = []
+            detectors = eiger.iter_cached_detectors(**kwargs)
+            try:
+                async for detector in detectors:
+                    found.append(detector.address)
+                    if stop:
+                        break
+            finally:
+                await detectors.aclose()
+            return found
+
+        found = asyncio.run(discover())
+        return found, Cache("detectors").entry("Eiger:8000"), refreshes
+
+    run.sweep = iter_detectors
+    run.refreshes = refreshes
+    return run
+
+
+def test_discovery_sweep(discovery):
+    found, (timestamp, value), refreshes = discovery()
+    assert found == ["10.0.0.1", "10.0.0.2"]
+    assert [item["address"] for item in value] == found
+    assert timestamp > 0
+    assert refreshes == []
+
+
+def test_discovery_failed_sweep(discovery):
+    async def failing(port, timeout):
+        raise OSError("no network")
+        yield
+
+    Cache("detectors").set("Eiger:8000", [detector_dict("10.0.0.9")], 100)
+    discovery.sweep = failing
+    with pytest.raises(OSError):
+        discovery(refresh=True)
+    # neither the cache nor a (failing again) background refresh
+    assert Cache("detectors").entry("Eiger:8000") == (
+        100, [detector_dict("10.0.0.9")]
+    )
+    assert discovery.refreshes == []
+
+
+def test_discovery_stopped(discovery):
+    Cache("detectors").set(
+        "Eiger:8000", [detector_dict("10.0.0.1"), detector_dict("10.0.0.2")], 100
+    )
+    found, (timestamp, value), refreshes = discovery(stop=True)
+    assert found == ["10.0.0.1"]
+    # not checked detectors are kept, stale cache refreshed in background
+    assert [item["address"] for item in value] == ["10.0.0.1", "10.0.0.2"]
+    assert timestamp == 100
+    assert len(refreshes) == 1
+
+
+def test_discovery_stopped_sweep(discovery):
+    found, (timestamp, value), refreshes = discovery(stop=True, refresh=True)
+    assert found == ["10.0.0.1"]
+    assert timestamp == 0
+    assert refreshes == []
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+from limatb import network
+from limatb.network import Sweep, sweep_connect_timeout
+
+
+def test_sweep_connect_timeout():
+    # a /22 (1022 addresses) in a 2 s scan (1.6 s probe budget)
+    timeout = sweep_connect_timeout(1022, 256, 1.6)
+    assert 4 * timeout <= 1.6
+    assert sweep_connect_timeout(10, 256, 2.0) == network.DEFAULT_CONNECT_TIMEOUT
+    assert sweep_connect_timeout(10, 256, None) == network.DEFAULT_CONNECT_TIMEOUT
+    assert sweep_connect_timeout(65534, 256, 1.0) == network.MIN_CONNECT_TIMEOUT
+
+
+def fake_connection(open_hosts):
+    """silent addresses answer only at the connect timeout"""
+
+    async def test_connection(host, port, timeout=None):
+        if host in open_hosts:
+            return host, True
+        await asyncio.sleep(timeout)
+        return host, False
+
+    return test_connection
+
+
+def sweep_hosts(addresses, timeout, concurrency):
+    async def run():
+        sweep = Sweep(concurrency)
+        try:
+            hosts = [h async for h in sweep.open_hosts(8000, timeout, addresses)]
+        finally:
+            sweep.close()
+        return sorted(hosts)
+
+    return asyncio.run(run())
+
+
+def test_sweep_finishes_within_timeout(monkeypatch, caplog):
+    addresses = [f"10.0.{i // 256}.{i % 256}" for i in range(1022)]
+    monkeypatch.setattr(network, "test_connection", fake_connection(addresses[-2:]))
+    with caplog.at_level(logging.WARNING):
+        assert sweep_hosts(addresses, 0.4, 256) == sorted(addresses[-2:])
+    assert "incomplete" not in caplog.text
+
+
+def test_sweep_incomplete_warning(monkeypatch, caplog):
+    addresses = [f"10.0.0.{i}" for i in range(100)]
+    monkeypatch.setattr(network, "test_connection", fake_connection(()))
+    # 100 rounds of MIN_CONNECT_TIMEOUT can't fit in 0.2 s
+    with caplog.at_level(logging.WARNING):
+        assert sweep_hosts(addresses, 0.2, 1) == []
+    assert "port 8000 sweep incomplete" in caplog.text